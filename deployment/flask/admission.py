@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+_log = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, retryAfterSecs: int):
+        super().__init__(message)
+        self.retryAfterSecs = retryAfterSecs
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Admission controller which limits the number of requests in flight. Requests exceeding the limit wait for a
+    short time and are rejected if no slot becomes free, such that overload results in fast rejections instead of
+    unbounded latency.
+
+    The limit adapts to the observed latencies (AIMD): it is increased additively (by about one per limit completed
+    requests) while latencies stay below a threshold and decreased multiplicatively (at most once per observed
+    latency) when they exceed it. The threshold is either a fixed target latency or a multiple of the baseline
+    latency, which tracks the minimum latency and slowly drifts up towards higher latencies.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, initialLimit: int, minLimit: int, maxLimit: int, maxQueueWaitMs: float, maxQueued: int,
+                 targetLatencyMs: Optional[float] = None, latencyTolerance: float = 2.0, backoffRatio: float = 0.9,
+                 retryAfterSecs: int = 1):
+        """
+        :param initialLimit: the initial number of requests admitted concurrently
+        :param minLimit: the lower bound of the limit
+        :param maxLimit: the upper bound of the limit
+        :param maxQueueWaitMs: the maximum time a request waits for a free slot before it is rejected
+        :param maxQueued: the maximum number of waiting requests; further requests are rejected immediately
+        :param targetLatencyMs: the latency above which the limit is decreased; if None, the threshold is derived
+            from the baseline latency
+        :param latencyTolerance: the factor by which latencies may exceed the baseline latency before the limit
+            is decreased (if no target latency is given)
+        :param backoffRatio: the factor applied to the limit when decreasing it
+        :param retryAfterSecs: the delay after which rejected clients are asked to retry
+        """
+        self.minLimit = max(1, minLimit)
+        self.maxLimit = max(self.minLimit, maxLimit)
+        self.limit = float(min(max(initialLimit, self.minLimit), self.maxLimit))
+        self.maxQueueWaitSecs = maxQueueWaitMs / 1000
+        self.maxQueued = maxQueued
+        self.targetLatencySecs = targetLatencyMs / 1000 if targetLatencyMs is not None else None
+        self.latencyTolerance = latencyTolerance
+        self.backoffRatio = backoffRatio
+        self.retryAfterSecs = retryAfterSecs
+        self.baselineLatencySecs: Optional[float] = None
+        self.inFlight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._lastDecrease = 0.0
+        self._condition = threading.Condition()
+        self.onQueueWait: Optional[Callable[[float], None]] = None
+
+    def acquire(self):
+        """
+        Admits a request, waiting for a free slot if necessary. Every successful call must be followed by a call
+        to release.
+
+        :raises AdmissionRejected: if the request is not admitted
+        """
+        start = time.monotonic()
+        with self._condition:
+            if self.inFlight >= int(self.limit):
+                if self.waiting >= self.maxQueued:
+                    self._reject("Too many requests waiting for admission")
+                self.waiting += 1
+                try:
+                    while self.inFlight >= int(self.limit):
+                        remainingSecs = start + self.maxQueueWaitSecs - time.monotonic()
+                        if remainingSecs <= 0:
+                            self._reject(f"No capacity within {self.maxQueueWaitSecs * 1000:.0f}ms")
+                        self._condition.wait(remainingSecs)
+                finally:
+                    self.waiting -= 1
+            self.inFlight += 1
+        if self.onQueueWait is not None:
+            self.onQueueWait(time.monotonic() - start)
+
+    def _reject(self, message: str):
+        self.rejected += 1
+        raise AdmissionRejected(f"{message} (limit {int(self.limit)}, in flight {self.inFlight})", self.retryAfterSecs)
+
+    def release(self, latencySecs: Optional[float]):
+        """
+        :param latencySecs: the latency of the completed request, which is used to adapt the limit; None if the
+            request's latency is not representative of the served model (e.g. it was answered by a fallback model)
+        """
+        with self._condition:
+            self.inFlight -= 1
+            if latencySecs is not None:
+                self._adaptLimit(latencySecs)
+            self._condition.notify()
+
+    def _adaptLimit(self, latencySecs: float):
+        if self.baselineLatencySecs is None or latencySecs < self.baselineLatencySecs:
+            self.baselineLatencySecs = latencySecs
+        else:
+            self.baselineLatencySecs += 0.01 * (latencySecs - self.baselineLatencySecs)
+        threshold = self.targetLatencySecs if self.targetLatencySecs is not None \
+            else self.baselineLatencySecs * self.latencyTolerance
+        if latencySecs > threshold:
+            now = time.monotonic()
+            if now - self._lastDecrease >= latencySecs:
+                self._lastDecrease = now
+                previousLimit = int(self.limit)
+                self.limit = max(self.minLimit, self.limit * self.backoffRatio)
+                if int(self.limit) != previousLimit:
+                    self._log.info(f"Decreased concurrency limit to {int(self.limit)} (latency {latencySecs * 1000:.1f}ms "
+                                   f"> {threshold * 1000:.1f}ms)")
+        else:
+            self.limit = min(self.maxLimit, self.limit + 1 / self.limit)
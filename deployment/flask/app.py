@@ -1,33 +1,168 @@
 #!/usr/bin/env python3
 
+import functools
 import logging
 import os
 import pickle
-from json.decoder import JSONDecodeError
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
 
 import jsonpickle
 import jsonpickle.ext.numpy as jsonpickle_numpy
 import pandas as pd
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, stream_with_context, g, has_request_context
 from flask.logging import default_handler
 from flask_restplus import Api, Resource, fields
 from sensai.vector_model import VectorModel
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType
+
+from admission import AdaptiveConcurrencyLimiter, AdmissionRejected
+from batching import MicroBatcher, StageCallback
+from deadlines import Deadline, DeadlineExceeded, checkDeadline, parseDeadline
+from degradation import FallbackRouter
+from inference import ChunkedPredictor, enablePrecomputedEncodings, getInputColumns, predictFromInputs, \
+    predictInStages, usePrecomputedEmbeddings, warmUp
+from metrics import MetricsRegistry, PROMETHEUS_MIMETYPE
+from model_registry import ModelRegistry, ModelArtifactWatcher
+from model_store import ModelNotFound, ModelStore
+from prediction_cache import PredictionCache
+from quantisation import QUANTISATION_INT8, quantiseModel
+from torchscript_backend import TorchScriptReviewClassifier
+from shadow import ShadowScorer
+from priority import PRIORITY_BULK, PRIORITY_CLASSES, PRIORITY_INTERACTIVE, PriorityGate, priorityRank
+from payload import ARROW_STREAM_MIMETYPE, COLUMNAR_JSON_MIMETYPE, NDJSON_MIMETYPE, PayloadError, decodeArrowStream, \
+    encodeArrowStream, isArrowSupported, decodeColumnarJson, encodeColumnarJson, iterNdjsonBatches, encodeNdjson, dumpsJson, \
+    decodeJsonPickle
 
 # COLLECT ENV VARIABLES ###############
 LOGLEVEL = os.environ.get('LOGLEVEL', 'WARNING').upper()
 PORT = int(os.environ.get('PORT', 20001))
 HOST = os.environ.get('HOST', None)
+MODEL_PATH = os.environ.get('MODEL_PATH', 'reviewClassifier-v1.pickle')
+# seconds between checks of the model artifact for changes; 0 disables hot reloading
+MODEL_RELOAD_INTERVAL_SECS = float(os.environ.get('MODEL_RELOAD_INTERVAL_SECS', 0))
+# sensai: MODEL_PATH is a pickled sensai VectorModel; torchscript: MODEL_PATH is a graph exported via
+# export_torchscript.py, which is applied with batched sentence encoding and without sensai's feature pipeline
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'sensai')
+# if set to int8, the MLP of loaded models is dynamically quantised to int8 (see quantise_model.py for an offline
+# conversion with an accuracy and latency report)
+MODEL_QUANTISATION = os.environ.get('MODEL_QUANTISATION', None)
+# directory with further models in the layout <name>/<version>/<file>.pickle (<file>.pt with <file>.json for the
+# torchscript backend), served at /api/v1/models/<name>/<version>/predict; if unset, only the model at MODEL_PATH is served
+MODEL_DIR = os.environ.get('MODEL_DIR', None)
+# memory budget (in terms of artifact sizes) of the models from MODEL_DIR kept resident
+MODEL_STORE_MAX_MB = float(os.environ.get('MODEL_STORE_MAX_MB', 2048))
+# candidate model to which a fraction of the requests to /api/v1/features is mirrored; if unset, shadow scoring is disabled
+SHADOW_MODEL_PATH = os.environ.get('SHADOW_MODEL_PATH', None)
+SHADOW_FRACTION = float(os.environ.get('SHADOW_FRACTION', 0.1))
+SHADOW_MAX_WORKERS = int(os.environ.get('SHADOW_MAX_WORKERS', 1))
+SHADOW_MAX_QUEUED = int(os.environ.get('SHADOW_MAX_QUEUED', 8))
+# directory of a feature table (built by preprocessing/emr/cleaning_spark.py) with the model inputs of known reviews,
+# served at /api/v1/features/by-id; if unset, the endpoint is disabled
+FEATURE_TABLE_PATH = os.environ.get('FEATURE_TABLE_PATH', None)
+# cheaper model to which a share of the requests to /api/v1/features is routed under overload; if unset, the
+# primary model serves all requests
+FALLBACK_MODEL_PATH = os.environ.get('FALLBACK_MODEL_PATH', None)
+FALLBACK_FRACTION = float(os.environ.get('FALLBACK_FRACTION', 0.5))
+# number of queued requests (admission, priority and batching queues) from which on the service counts as overloaded
+FALLBACK_QUEUE_DEPTH = int(os.environ.get('FALLBACK_QUEUE_DEPTH', 8))
+# 95th percentile of recent primary latencies above which the service counts as overloaded; if unset, it is ignored
+FALLBACK_P95_LATENCY_MS = os.environ.get('FALLBACK_P95_LATENCY_MS', None)
+# whether requests rejected by admission control are served by the fallback model instead (if it is loaded)
+FALLBACK_ON_REJECTION = os.environ.get('FALLBACK_ON_REJECTION', '1') == '1'
+# number of fallback predictions running concurrently; fallback requests beyond it are served by the primary model or,
+# if they were rejected by admission control, rejected with 503
+FALLBACK_MAX_CONCURRENCY = int(os.environ.get('FALLBACK_MAX_CONCURRENCY', 2))
+# age in seconds up to which primary latencies are considered for the p95 overload signal
+FALLBACK_LATENCY_WINDOW_SECS = float(os.environ.get('FALLBACK_LATENCY_WINDOW_SECS', 30))
+# minimum time in seconds between attempts to load the fallback model after a failed load
+FALLBACK_LOAD_RETRY_SECS = float(os.environ.get('FALLBACK_LOAD_RETRY_SECS', 60))
+# maximum number of rows per micro-batch of concurrent requests; 0 disables micro-batching
+BATCH_MAX_ROWS = int(os.environ.get('BATCH_MAX_ROWS', 0))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+# number of rows above which inputs are split into chunks which are predicted in parallel; 0 disables chunking
+PREDICT_CHUNK_ROWS = int(os.environ.get('PREDICT_CHUNK_ROWS', 0))
+PREDICT_CHUNK_WORKERS = int(os.environ.get('PREDICT_CHUNK_WORKERS', 2))
+# number of torch intra-op threads set when chunked prediction is used; 0 keeps torch's setting
+PREDICT_CHUNK_TORCH_THREADS = int(os.environ.get('PREDICT_CHUNK_TORCH_THREADS', 0))
+# number of records scored at once by the streaming endpoint
+STREAM_BATCH_ROWS = int(os.environ.get('STREAM_BATCH_ROWS', 256))
+# maximum number of cached prediction rows; 0 disables the prediction cache
+PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 0))
+PREDICTION_CACHE_TTL_SECS = float(os.environ.get('PREDICTION_CACHE_TTL_SECS', 3600))
+PREDICTION_CACHE_MAX_MB = float(os.environ.get('PREDICTION_CACHE_MAX_MB', 64))
+# number of synthetic predictions run after loading a model and before serving it; 0 disables the warm-up
+WARMUP_ITERATIONS = int(os.environ.get('WARMUP_ITERATIONS', 3))
+WARMUP_ROWS = int(os.environ.get('WARMUP_ROWS', 8))
+WARMUP_TEXT = os.environ.get('WARMUP_TEXT', 'This gift card was easy to use and arrived right on time.')
+# optional file with a representative input in the columnar JSON format, used instead of the synthetic warm-up input
+WARMUP_INPUT_PATH = os.environ.get('WARMUP_INPUT_PATH', None)
+# upper bound of the adaptive limit on concurrently processed prediction requests; 0 disables admission control
+ADMISSION_MAX_LIMIT = int(os.environ.get('ADMISSION_MAX_LIMIT', 0))
+ADMISSION_MIN_LIMIT = int(os.environ.get('ADMISSION_MIN_LIMIT', 1))
+ADMISSION_INITIAL_LIMIT = int(os.environ.get('ADMISSION_INITIAL_LIMIT', 4))
+ADMISSION_MAX_QUEUE_WAIT_MS = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT_MS', 50))
+ADMISSION_MAX_QUEUED = int(os.environ.get('ADMISSION_MAX_QUEUED', 32))
+# latency above which the limit is decreased; if unset, it is derived from the observed baseline latency
+ADMISSION_TARGET_LATENCY_MS = os.environ.get('ADMISSION_TARGET_LATENCY_MS', None)
+# maximum number of predictions running concurrently across priority classes; 0 disables priority scheduling
+PRIORITY_MAX_CONCURRENCY = int(os.environ.get('PRIORITY_MAX_CONCURRENCY', 0))
+PRIORITY_INTERACTIVE_MAX_CONCURRENCY = int(os.environ.get('PRIORITY_INTERACTIVE_MAX_CONCURRENCY', PRIORITY_MAX_CONCURRENCY))
+PRIORITY_BULK_MAX_CONCURRENCY = int(os.environ.get('PRIORITY_BULK_MAX_CONCURRENCY', 1))
 #######################################
 
-logging.basicConfig(level=LOGLEVEL)
+class RequestIdLogFilter(logging.Filter):
+    """
+    Adds the ID of the request being handled (or '-' outside of requests) to log records as attribute requestId
+    """
+    def filter(self, record):
+        record.requestId = g.get("requestId", "-") if has_request_context() else "-"
+        return True
+
+
+logging.basicConfig(level=LOGLEVEL, format="%(asctime)s %(levelname)s [%(requestId)s] %(name)s: %(message)s")
 root = logging.getLogger()
 root.addHandler(default_handler)
+for handler in root.handlers:
+    handler.addFilter(RequestIdLogFilter())
+_log = logging.getLogger(__name__)
 jsonpickle_numpy.register_handlers()
 
 app = Flask(__name__)
 api = Api(app)
 
+REQUEST_ID_HEADER = 'X-Request-ID'
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+@app.before_request
+def _startRequest():
+    requestId = request.headers.get(REQUEST_ID_HEADER, "")
+    g.requestId = requestId if _VALID_REQUEST_ID.match(requestId) else uuid.uuid4().hex
+    g.requestStart = time.perf_counter()
+    g.requestArrival = time.monotonic()
+    g.stageTimings = {}
+
+
+@app.after_request
+def _finishRequest(response: Response) -> Response:
+    """
+    Adds the request ID and a Server-Timing header with the durations of the request's stages to the response
+    """
+    totalMs = (time.perf_counter() - g.requestStart) * 1000
+    serverTimings = [f"{stage};dur={durationSecs * 1000:.2f}" for stage, durationSecs in g.stageTimings.items()]
+    serverTimings.append(f"total;dur={totalMs:.2f}")
+    response.headers[REQUEST_ID_HEADER] = g.requestId
+    response.headers['Server-Timing'] = ", ".join(serverTimings)
+    if "modelTag" in g:
+        response.headers[MODEL_HEADER] = g.modelTag
+    _log.info(f"{request.method} {request.path} {response.status_code} in {totalMs:.1f}ms")
+    return response
+
+
 DATA_TOKEN = 'data'
 
 RESOURCE_FIELDS = api.model('Resource', {
@@ -35,38 +170,692 @@ RESOURCE_FIELDS = api.model('Resource', {
 })
 
 
-def loadModel() -> VectorModel:
-    with open("reviewClassifier-v1.pickle", 'rb') as f:
+STAGE_JSON_PARSE = "json_parse"
+STAGE_DECODE = "decode"
+STAGE_ENCODE = "encode"
+STAGE_LOOKUP = "lookup"
+
+metricsRegistry = MetricsRegistry()
+stageDurationHistogram = metricsRegistry.histogram("prediction_stage_duration_seconds",
+    "Duration of the stages of prediction requests (feature generation and predict are measured per model call)",
+    labelNames=["stage"])
+requestCounter = metricsRegistry.counter("prediction_requests_total", "Number of prediction requests", labelNames=["endpoint"])
+rowCounter = metricsRegistry.counter("prediction_rows_total", "Number of rows predicted", labelNames=["endpoint"])
+
+
+def observeStage(stage: str, durationSecs: float):
+    stageDurationHistogram.observe(durationSecs, stage=stage)
+
+
+def _ignoreStage(stage: str, durationSecs: float):
+    pass
+
+
+def requestStageRecorder() -> StageCallback:
+    """
+    :return: a callback which adds stage durations to the Server-Timing of the current request and which may be
+        called from other threads
+    """
+    stageTimings = g.stageTimings
+
+    def recordStage(stage: str, durationSecs: float):
+        stageTimings[stage] = stageTimings.get(stage, 0.0) + durationSecs
+
+    return recordStage
+
+
+@contextmanager
+def timedStage(stage: str):
+    start = time.perf_counter()
+    yield
+    durationSecs = time.perf_counter() - start
+    observeStage(stage, durationSecs)
+    if has_request_context():
+        g.stageTimings[stage] = g.stageTimings.get(stage, 0.0) + durationSecs
+
+
+def loadModel(path: str = MODEL_PATH) -> VectorModel:
+    if MODEL_BACKEND == 'torchscript':
+        return TorchScriptReviewClassifier.load(path)
+    if MODEL_BACKEND != 'sensai':
+        raise ValueError(f"Unsupported MODEL_BACKEND: {MODEL_BACKEND}")
+    with open(path, 'rb') as f:
         model = pickle.load(f)
+    if MODEL_QUANTISATION == QUANTISATION_INT8:
+        model = quantiseModel(model)
+    elif MODEL_QUANTISATION is not None:
+        raise ValueError(f"Unsupported MODEL_QUANTISATION: {MODEL_QUANTISATION}")
+    enablePrecomputedEncodings(model)
     return model
 
 
+def createWarmUpInput() -> pd.DataFrame:
+    if WARMUP_INPUT_PATH is not None:
+        with open(WARMUP_INPUT_PATH, 'rb') as f:
+            return decodeColumnarJson(f.read())
+    return pd.DataFrame({"reviewText": [WARMUP_TEXT] * WARMUP_ROWS},
+                        index=[f"warmup_{i}" for i in range(WARMUP_ROWS)])
+
+
+def warmUpModel(model: VectorModel):
+    if WARMUP_ITERATIONS > 0:
+        warmUp(model, createWarmUpInput(), WARMUP_ITERATIONS)
+
+
+def warmUpReloadedModel(model: VectorModel):
+    # a hot-reloaded version replaces a model under live traffic, so it is always warmed up before the swap
+    warmUp(model, createWarmUpInput(), max(1, WARMUP_ITERATIONS))
+
+
+modelRegistry = ModelRegistry(MODEL_PATH, loadModel, warmUp=warmUpModel, reloadWarmUp=warmUpReloadedModel)
+modelWatcher = ModelArtifactWatcher(modelRegistry, MODEL_RELOAD_INTERVAL_SECS) if MODEL_RELOAD_INTERVAL_SECS > 0 else None
+metricsRegistry.gauge("model_load_duration_seconds", "Time taken to load the current model",
+                      lambda: modelRegistry.loadTimeSecs)
+
+
+modelStore = ModelStore(MODEL_DIR, loadModel, int(MODEL_STORE_MAX_MB * 1024 * 1024), warmUp=warmUpModel,
+                        artifactExtension=".pt" if MODEL_BACKEND == 'torchscript' else ".pickle") \
+    if MODEL_DIR is not None else None
+if modelStore is not None:
+    metricsRegistry.gauge("model_store_resident_models", "Number of models from the model directory kept in memory",
+                          modelStore.numResident)
+    metricsRegistry.counter("model_store_evictions_total", "Number of models evicted from memory",
+                            fn=lambda: modelStore.evictions)
+
+
+shadowScorer = ShadowScorer(ModelRegistry(SHADOW_MODEL_PATH, loadModel, warmUp=warmUpModel), SHADOW_FRACTION,
+                            SHADOW_MAX_WORKERS, SHADOW_MAX_QUEUED) if SHADOW_MODEL_PATH is not None else None
+if shadowScorer is not None:
+    shadowLatencyHistogram = metricsRegistry.histogram("shadow_prediction_duration_seconds",
+        "Prediction latency of mirrored requests for the primary and the shadow model", labelNames=("model",))
+    shadowRowCounter = metricsRegistry.counter("shadow_rows_total", "Number of rows scored by the shadow model")
+    shadowAgreementCounter = metricsRegistry.counter("shadow_agreeing_rows_total",
+        "Number of rows on which the shadow model's predictions equal the primary model's")
+
+    def _recordShadowResult(numRows: int, numAgreeing: int, primaryLatencySecs: float, shadowLatencySecs: float):
+        shadowLatencyHistogram.observe(primaryLatencySecs, model="primary")
+        shadowLatencyHistogram.observe(shadowLatencySecs, model="shadow")
+        shadowRowCounter.inc(numRows)
+        shadowAgreementCounter.inc(numAgreeing)
+
+    shadowScorer.onResult = _recordShadowResult
+    metricsRegistry.counter("shadow_dropped_total", "Number of requests not mirrored because the shadow pool was busy",
+                            fn=lambda: shadowScorer.dropped)
+    metricsRegistry.counter("shadow_errors_total", "Number of failed shadow predictions", fn=lambda: shadowScorer.errors)
+
+
 def get_model() -> VectorModel:
-    if 'model' not in g:
-        g.model = loadModel()
+    if modelWatcher is not None:
+        modelWatcher.ensureStarted()
+    return modelRegistry.getModel()
+
+
+chunkedPredictor = ChunkedPredictor(PREDICT_CHUNK_ROWS, PREDICT_CHUNK_WORKERS, PREDICT_CHUNK_TORCH_THREADS) \
+    if PREDICT_CHUNK_ROWS > 0 else None
+
+
+def _observingStageRecorder(onStage: StageCallback) -> StageCallback:
+    """
+    :return: a callback which records stage durations in the stage histogram and forwards them to onStage
+    """
+    def observeAndForwardStage(stage: str, durationSecs: float):
+        observeStage(stage, durationSecs)
+        onStage(stage, durationSecs)
+
+    return observeAndForwardStage
+
+
+def _predictWithModel(model: VectorModel, x: pd.DataFrame, onStage: StageCallback, deadline: Optional[Deadline]) \
+        -> pd.DataFrame:
+    observeAndForwardStage = _observingStageRecorder(onStage)
+    if chunkedPredictor is not None:
+        return chunkedPredictor.predict(model, x, observeAndForwardStage, deadline)
+    return predictInStages(model, x, observeAndForwardStage, deadline)
+
+
+def _predictWithCurrentModel(x: pd.DataFrame, onStage: StageCallback, deadline: Optional[Deadline]) -> pd.DataFrame:
+    return _predictWithModel(get_model(), x, onStage, deadline)
+
+
+predictionCache = PredictionCache(PREDICTION_CACHE_MAX_ENTRIES, PREDICTION_CACHE_TTL_SECS,
+                                  int(PREDICTION_CACHE_MAX_MB * 1024 * 1024)) if PREDICTION_CACHE_MAX_ENTRIES > 0 else None
+if predictionCache is not None:
+    metricsRegistry.counter("prediction_cache_hits_total", "Number of rows served from the prediction cache",
+                            fn=lambda: predictionCache.hits)
+    metricsRegistry.counter("prediction_cache_misses_total", "Number of rows not found in the prediction cache",
+                            fn=lambda: predictionCache.misses)
+    metricsRegistry.gauge("prediction_cache_bytes", "Approximate memory used by the prediction cache",
+                          lambda: predictionCache.numBytes)
+
+
+priorityGate = PriorityGate(PRIORITY_MAX_CONCURRENCY, {PRIORITY_INTERACTIVE: PRIORITY_INTERACTIVE_MAX_CONCURRENCY,
+    PRIORITY_BULK: PRIORITY_BULK_MAX_CONCURRENCY}) if PRIORITY_MAX_CONCURRENCY > 0 else None
+if priorityGate is not None:
+    for priorityClass in PRIORITY_CLASSES:
+        metricsRegistry.gauge(f"priority_{priorityClass}_in_flight",
+                              f"Number of running {priorityClass} predictions",
+                              lambda priorityClass=priorityClass: priorityGate.inFlight[priorityClass])
+        metricsRegistry.gauge(f"priority_{priorityClass}_waiting",
+                              f"Number of {priorityClass} predictions waiting for a slot",
+                              lambda priorityClass=priorityClass: priorityGate.numWaiting(priorityClass))
+
+
+@contextmanager
+def prioritySlot(priorityClass: str, deadline: Optional[Deadline] = None):
+    """
+    Context manager which waits for a prediction slot of the given priority class (if priority scheduling is enabled)
+    """
+    if priorityGate is None:
+        yield
+    else:
+        with priorityGate.slot(priorityClass, deadline):
+            yield
+
+
+def _batchSlot(priority: int, deadline: Optional[Deadline]):
+    return prioritySlot(PRIORITY_CLASSES[priority], deadline)
+
+
+# the batcher takes the priority slot per batch, so requests waiting in its queue do not occupy slots; it predicts as
+# many batches per priority class concurrently as the priority gate admits
+batcher = MicroBatcher(_predictWithCurrentModel, BATCH_MAX_ROWS, BATCH_MAX_WAIT_MS, slot=_batchSlot,
+                       maxConcurrency=max(1, PRIORITY_MAX_CONCURRENCY)) \
+    if BATCH_MAX_ROWS > 0 else None
+
+
+def _predictUncached(x: pd.DataFrame, onStage: StageCallback, deadline: Optional[Deadline], priorityClass: str,
+                     registry: Optional[ModelRegistry]) -> pd.DataFrame:
+    if registry is None and batcher is not None:
+        return batcher.predict(x, onStage, deadline, priorityRank(priorityClass))
+    with prioritySlot(priorityClass, deadline):
+        if registry is not None:
+            return _predictWithModel(registry.getModel(), x, onStage, deadline)
+        return _predictWithCurrentModel(x, onStage, deadline)
+
+
+def predictDataFrame(x: pd.DataFrame, onStage: StageCallback = _ignoreStage, deadline: Optional[Deadline] = None,
+                     priorityClass: str = PRIORITY_INTERACTIVE, registry: Optional[ModelRegistry] = None) \
+        -> pd.DataFrame:
+    """
+    :param x: the input data frame
+    :param onStage: callback receiving the durations of the model's stages (feature generation and predict)
+    :param deadline: the deadline after which the prediction is abandoned
+    :param priorityClass: the priority class (one of PRIORITY_CLASSES) whose concurrency budget the prediction uses
+    :param registry: the registry holding the model to apply (e.g. one from the model store); if None, the default
+        model is applied (with micro-batching, if enabled)
+    :return: the predictions
+    :raises DeadlineExceeded: if the deadline passed before the prediction was completed
+    """
+    if predictionCache is not None:
+        (registry or modelRegistry).getModel()  # makes sure the model is loaded, such that its version is known
+        return predictionCache.predict(x,
+            lambda misses: _predictUncached(misses, onStage, deadline, priorityClass, registry),
+            (registry or modelRegistry).version)
+    return _predictUncached(x, onStage, deadline, priorityClass, registry)
+
+
+admissionController = AdaptiveConcurrencyLimiter(ADMISSION_INITIAL_LIMIT, ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT,
+    ADMISSION_MAX_QUEUE_WAIT_MS, ADMISSION_MAX_QUEUED,
+    targetLatencyMs=float(ADMISSION_TARGET_LATENCY_MS) if ADMISSION_TARGET_LATENCY_MS is not None else None) \
+    if ADMISSION_MAX_LIMIT > 0 else None
+if admissionController is not None:
+    admissionQueueWaitHistogram = metricsRegistry.histogram("admission_queue_wait_seconds",
+        "Time requests waited for admission")
+    admissionController.onQueueWait = admissionQueueWaitHistogram.observe
+    metricsRegistry.gauge("admission_concurrency_limit", "Current adaptive limit on concurrent prediction requests",
+                          lambda: int(admissionController.limit))
+    metricsRegistry.gauge("admission_in_flight", "Number of admitted prediction requests in flight",
+                          lambda: admissionController.inFlight)
+    metricsRegistry.gauge("admission_waiting", "Number of prediction requests waiting for admission",
+                          lambda: admissionController.waiting)
+    metricsRegistry.counter("admission_rejected_total", "Number of prediction requests rejected by admission control",
+                            fn=lambda: admissionController.rejected)
+    metricsRegistry.gauge("admission_baseline_latency_seconds", "Baseline latency of admitted prediction requests",
+                          lambda: admissionController.baselineLatencySecs)
+
+
+def loadFallbackModel(path: str) -> VectorModel:
+    """
+    Loads a pickled fallback model. MODEL_BACKEND and MODEL_QUANTISATION only apply to the primary model, since fallback
+    models (e.g. linear or bag-of-words models) are generally neither TorchScript graphs nor torch classifiers.
+    """
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    if isinstance(model, VectorModel):
+        enablePrecomputedEncodings(model)
+    return model
+
+
+fallbackRegistry = ModelRegistry(FALLBACK_MODEL_PATH, loadFallbackModel, warmUp=warmUpModel) \
+    if FALLBACK_MODEL_PATH is not None else None
+if fallbackRegistry is not None:
+    queueDepthFns = []
+    if admissionController is not None:
+        queueDepthFns.append(lambda: admissionController.waiting)
+    if priorityGate is not None:
+        queueDepthFns.append(lambda: sum(priorityGate.numWaiting(c) for c in PRIORITY_CLASSES))
+    if batcher is not None:
+        queueDepthFns.append(batcher.numQueued)
+    fallbackRouter = FallbackRouter(fallbackRegistry, FALLBACK_FRACTION, FALLBACK_QUEUE_DEPTH, queueDepthFns,
+        p95LatencyMs=float(FALLBACK_P95_LATENCY_MS) if FALLBACK_P95_LATENCY_MS is not None else None,
+        latencyWindowSecs=FALLBACK_LATENCY_WINDOW_SECS, maxConcurrency=FALLBACK_MAX_CONCURRENCY,
+        loadRetryIntervalSecs=FALLBACK_LOAD_RETRY_SECS)
+    metricsRegistry.gauge("fallback_degraded", "Whether requests are currently routed to the fallback model",
+                          lambda: int(fallbackRouter.isDegraded()))
+    metricsRegistry.gauge("fallback_primary_p95_latency_seconds",
+                          "95th percentile of recent prediction latencies of the primary model",
+                          fallbackRouter.getP95LatencySecs)
+else:
+    fallbackRouter = None
+modelRequestCounter = metricsRegistry.counter("model_requests_total", "Number of prediction requests per serving model",
+                                              labelNames=("model",))
+
+MODEL_HEADER = 'X-Model'
+MODEL_PRIMARY = "primary"
+MODEL_FALLBACK = "fallback"
 
-    return g.model
+
+def withAdmissionControl(fn=None, *, allowFallback: bool = False):
+    """
+    Decorator for request handlers which answers with 503 and Retry-After if admission control rejects the request
+
+    :param allowFallback: whether rejected requests are handled with g.useFallback set instead (if enabled via
+        FALLBACK_ON_REJECTION, the fallback model is loaded and one of its concurrency slots is free)
+    """
+    if fn is None:
+        return functools.partial(withAdmissionControl, allowFallback=allowFallback)
+
+    @functools.wraps(fn)
+    def handle(*args, **kwargs):
+        if admissionController is None:
+            return fn(*args, **kwargs)
+        try:
+            admissionController.acquire()
+        except AdmissionRejected as e:
+            if allowFallback and FALLBACK_ON_REJECTION and fallbackRouter is not None \
+                    and fallbackRouter.isFallbackAvailable() and fallbackRouter.tryAcquireSlot():
+                _log.info(f"Serving rejected request with fallback model: {e}")
+                g.useFallback = True
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    fallbackRouter.releaseSlot()
+            _log.warning(f"Rejected request: {e}")
+            return {"message": str(e)}, 503, {"Retry-After": str(e.retryAfterSecs)}
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # the fallback model's short latencies would lower the baseline and thus tighten the limit further
+            admissionController.release(time.perf_counter() - start if g.get("modelTag") != MODEL_FALLBACK else None)
+
+    return handle
+
+
+PRIORITY_HEADER = 'X-Priority'
+TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+DEADLINE_HEADER = 'X-Request-Deadline'
+
+
+def _parseDeadline() -> Optional[Deadline]:
+    """
+    :return: the request's deadline, given either relative to its arrival in milliseconds (X-Request-Timeout-Ms)
+        or as an absolute unix timestamp in seconds (X-Request-Deadline)
+    """
+    try:
+        return parseDeadline(request.headers.get(TIMEOUT_HEADER), request.headers.get(DEADLINE_HEADER),
+                             g.requestArrival)
+    except ValueError:
+        raise BadRequest(f"{TIMEOUT_HEADER} and {DEADLINE_HEADER} have to be finite numbers")
+
+
+def _requestPriorityClass(default: str) -> str:
+    """
+    :param default: the priority class of the endpoint, which applies if the client did not send X-Priority
+    :return: the priority class of the request
+    """
+    priorityClass = request.headers.get(PRIORITY_HEADER, default).lower()
+    if priorityClass not in PRIORITY_CLASSES:
+        raise BadRequest(f"{PRIORITY_HEADER} has to be one of {', '.join(PRIORITY_CLASSES)}")
+    return priorityClass
+
+
+def withDeadline(fn):
+    """
+    Decorator for request handlers which parses the request's deadline into g.deadline and answers with 504 if
+    the handler raises DeadlineExceeded
+    """
+    @functools.wraps(fn)
+    def handle(*args, **kwargs):
+        g.deadline = _parseDeadline()
+        try:
+            return fn(*args, **kwargs)
+        except DeadlineExceeded as e:
+            _log.info(f"Abandoned request: {e}")
+            return {"message": str(e)}, 504
+
+    return handle
+
+
+def _decodeJsonPickleRequest() -> pd.DataFrame:
+    with timedStage(STAGE_JSON_PARSE):
+        content = request.get_json()
+    RESOURCE_FIELDS.validate(content)
+    try:
+        with timedStage(STAGE_DECODE):
+            return decodeJsonPickle(content[DATA_TOKEN])
+    except PayloadError as e:
+        raise BadRequest(str(e))
+
+
+def _decodeArrowRequest() -> pd.DataFrame:
+    if not isArrowSupported():
+        raise UnsupportedMediaType(f"{ARROW_STREAM_MIMETYPE} requires pyarrow, which is not installed")
+    try:
+        with timedStage(STAGE_DECODE):
+            return decodeArrowStream(request.get_data())
+    except PayloadError as e:
+        raise BadRequest(str(e))
+
+
+def _decodeColumnarJsonRequest() -> pd.DataFrame:
+    try:
+        with timedStage(STAGE_DECODE):
+            return decodeColumnarJson(request.get_data())
+    except PayloadError as e:
+        raise BadRequest(str(e))
+
+
+def _negotiateResponseMimetype() -> str:
+    """
+    Binary and columnar requests are answered in their own format unless the Accept header excludes it;
+    jsonpickle requests are answered with jsonpickle unless another supported format is explicitly preferred
+    """
+    accepted = request.accept_mimetypes
+    if request.mimetype in (ARROW_STREAM_MIMETYPE, COLUMNAR_JSON_MIMETYPE):
+        if not accepted or accepted[request.mimetype] > 0:
+            return request.mimetype
+    supportedMimetypes = [COLUMNAR_JSON_MIMETYPE] + ([ARROW_STREAM_MIMETYPE] if isArrowSupported() else [])
+    if accepted.best in supportedMimetypes:
+        return accepted.best
+    return "application/json"
+
+
+def _servePrediction(endpoint: str, registry: Optional[ModelRegistry] = None, modelTag: str = MODEL_PRIMARY):
+    """
+    Decodes the request's data frame, applies the model and encodes the predictions in the negotiated format.
+    Requests for the default model are served by the fallback model if they were admitted as such or if the
+    fallback router decides so and one of the fallback model's concurrency slots is free.
+
+    :param endpoint: the endpoint name used in metrics
+    :param registry: the registry holding the model to apply; if None, the default model is applied
+    :param modelTag: the name of the model reported in the X-Model response header
+    """
+    useFallback = registry is None and g.get("useFallback", False)  # the slot is held by withAdmissionControl
+    holdsFallbackSlot = False
+    if registry is None and not useFallback and fallbackRouter is not None and fallbackRouter.shouldUseFallback():
+        # if the fallback model's budget is exhausted, the request stays with the primary model
+        useFallback = holdsFallbackSlot = fallbackRouter.tryAcquireSlot()
+    try:
+        if useFallback:
+            return _predictAndRespond(endpoint, fallbackRegistry, MODEL_FALLBACK, isFallback=True)
+        return _predictAndRespond(endpoint, registry, modelTag, isFallback=False)
+    finally:
+        if holdsFallbackSlot:
+            fallbackRouter.releaseSlot()
+
+
+def _predictAndRespond(endpoint: str, registry: Optional[ModelRegistry], modelTag: str, isFallback: bool):
+    g.modelTag = modelTag
+    modelRequestCounter.inc(model=modelTag)
+    checkDeadline(g.deadline, STAGE_DECODE)
+    if request.mimetype == ARROW_STREAM_MIMETYPE:
+        x = _decodeArrowRequest()
+    elif request.mimetype == COLUMNAR_JSON_MIMETYPE:
+        x = _decodeColumnarJsonRequest()
+    else:
+        x = _decodeJsonPickleRequest()
+    requestCounter.inc(endpoint=endpoint)
+    rowCounter.inc(len(x), endpoint=endpoint)
+    try:
+        x = usePrecomputedEmbeddings((registry or modelRegistry).getModel(), x)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+    start = time.perf_counter()
+    if isFallback:
+        # fallback predictions bypass the priority slots and micro-batching queue of the overloaded primary model
+        y = _predictWithModel(registry.getModel(), x, requestStageRecorder(), g.deadline)
+    else:
+        y = predictDataFrame(x, requestStageRecorder(), g.deadline, _requestPriorityClass(PRIORITY_INTERACTIVE),
+                             registry=registry)
+    if registry is None:
+        latencySecs = time.perf_counter() - start
+        if fallbackRouter is not None:
+            fallbackRouter.recordPrimaryLatency(latencySecs)
+        if shadowScorer is not None:
+            shadowScorer.maybeMirror(x, y, latencySecs)
+    with timedStage(STAGE_ENCODE):
+        responseMimetype = _negotiateResponseMimetype()
+        if responseMimetype == ARROW_STREAM_MIMETYPE:
+            return Response(encodeArrowStream(y), mimetype=ARROW_STREAM_MIMETYPE)
+        if responseMimetype == COLUMNAR_JSON_MIMETYPE:
+            return Response(encodeColumnarJson(y), mimetype=COLUMNAR_JSON_MIMETYPE)
+        return jsonify(prediction=jsonpickle.encode(y))
 
 
 @api.route('/api/v1/features', methods=['post'])
 class SamplePredictor(Resource):
-    @api.expect(RESOURCE_FIELDS, validate=True)
+    @api.expect(RESOURCE_FIELDS)
+    @api.doc(description=f"Accepts a jsonpickle-encoded data frame in JSON or, with content type "
+                         f"{COLUMNAR_JSON_MIMETYPE}, a data frame as plain JSON "
+                         f'{{"columns": [...], "index": [...], "data": [[...], ...]}} or, with content type '
+                         f"{ARROW_STREAM_MIMETYPE}, an Arrow IPC stream. Columnar JSON and Arrow requests are "
+                         f"answered in the same format unless the Accept header asks for another one. "
+                         f"Under overload, requests are rejected with 503 and a Retry-After header. "
+                         f"Clients may set a deadline via {TIMEOUT_HEADER} (milliseconds) or {DEADLINE_HEADER} "
+                         f"(unix time in seconds); requests whose deadline passes are abandoned with 504. "
+                         f"Requests are scored with {PRIORITY_INTERACTIVE} priority unless {PRIORITY_HEADER} is set "
+                         f"to {PRIORITY_BULK}.")
+    @withAdmissionControl(allowFallback=True)
+    @withDeadline
     def post(self):
-        content = request.get_json()
+        return _servePrediction("features")
+
+
+if FEATURE_TABLE_PATH is not None:
+    from models.feature_table import FeatureTable
+    featureTable = FeatureTable(FEATURE_TABLE_PATH)
+    _log.info(f"Mapped feature table with {len(featureTable)} rows from {FEATURE_TABLE_PATH}")
+else:
+    featureTable = None
+IDENTIFIERS_KEY = "identifiers"
+_reportedFeatureTableMismatches = set()
+
+
+def getFeatureTableMismatch(model: VectorModel, version: str) -> Optional[str]:
+    """
+    Checks the columns of the feature table against the inputs of the given model (version), logging a mismatch once
+    per model version
+
+    :return: a description of the mismatch or None if the table's rows can be passed to the model
+    """
+    try:
+        featureTable.checkColumns(getInputColumns(model))
+        return None
+    except ValueError as e:
+        message = f"The feature table {FEATURE_TABLE_PATH} does not match the inputs of model version " \
+                  f"{str(version)[:12]} and has to be rebuilt: {e}"
+        if version not in _reportedFeatureTableMismatches:
+            _reportedFeatureTableMismatches.add(version)
+            _log.error(message)
+        return message
+
+
+def checkFeatureTable():
+    """
+    Logs an error if the feature table (if any) does not match the current model; to be called after loading the model
+    """
+    if featureTable is not None:
+        getFeatureTableMismatch(modelRegistry.getModel(), modelRegistry.version)
+
+
+@api.route('/api/v1/features/by-id', methods=['post'])
+class IdentifierPredictor(Resource):
+    @api.doc(description=f'Accepts {{"{IDENTIFIERS_KEY}": [...]}} with the identifiers of reviews processed by the '
+                         f"batch pipeline, looks their model inputs up in the feature table and applies the model "
+                         f"without any text transfer or encoding. Returns the predictions as columnar JSON with an "
+                         f"additional list 'missing' of the identifiers which are not in the table.")
+    @withAdmissionControl
+    @withDeadline
+    def post(self):
+        if featureTable is None:
+            raise NotFound("No feature table is configured (FEATURE_TABLE_PATH)")
+        with timedStage(STAGE_JSON_PARSE):
+            content = request.get_json(silent=True)
+        identifiers = content.get(IDENTIFIERS_KEY) if isinstance(content, dict) else None
+        if not isinstance(identifiers, list) or not all(isinstance(i, str) for i in identifiers):
+            raise BadRequest(f"The input has to be a JSON object with a list of strings '{IDENTIFIERS_KEY}'")
+        requestCounter.inc(endpoint="by-id")
+        rowCounter.inc(len(identifiers), endpoint="by-id")
+
         model = get_model()
-        x = content[DATA_TOKEN]
-        try:
-            x = jsonpickle.decode(x)  # expects a numpy array with dimensions (h, w, n_channels)
-        except JSONDecodeError:
-            raise BadRequest("The input string could not be decoded")
-        if not isinstance(x, pd.DataFrame):
-            raise BadRequest("The input has to be a numpy array. Instead got {}".format(x.__class__))
+        # a hot reload may have swapped in a model with other inputs, so the check is repeated per request
+        mismatch = getFeatureTableMismatch(model, modelRegistry.version)
+        if mismatch is not None:
+            return {"message": mismatch}, 500
+        with timedStage(STAGE_LOOKUP):
+            inputs, missing = featureTable.lookupDataFrame(identifiers)
+        with prioritySlot(_requestPriorityClass(PRIORITY_INTERACTIVE), g.deadline):
+            if len(inputs) == 0:
+                y = pd.DataFrame(index=inputs.index)
+            elif isinstance(model, VectorModel):
+                y = predictFromInputs(model, inputs, _observingStageRecorder(requestStageRecorder()), g.deadline)
+            else:
+                y = model.predict(inputs)
+        with timedStage(STAGE_ENCODE):
+            return Response(dumpsJson({"columns": [str(c) for c in y.columns], "index": list(y.index),
+                                       "data": y.values.tolist(), "missing": missing}),
+                            mimetype="application/json")
+
+
+@api.route('/api/v1/features/stream', methods=['post'])
+class StreamingPredictor(Resource):
+    @api.doc(description=f"Accepts newline-delimited JSON records ({NDJSON_MIMETYPE}), each mapping column names to "
+                         f"values, and streams back one prediction record per input record as soon as its batch has been "
+                         f"scored. Records are scored in batches of {STREAM_BATCH_ROWS} rows, so memory use does not "
+                         f"depend on the size of the upload. Batches are scored with {PRIORITY_BULK} priority unless "
+                         f"{PRIORITY_HEADER} is set to {PRIORITY_INTERACTIVE}.")
+    def post(self):
+        model = get_model()
+        priorityClass = _requestPriorityClass(PRIORITY_BULK)
+        lines = request.stream
+        requestCounter.inc(endpoint="stream")
+
+        def generatePredictions():
+            numRows = 0
+            try:
+                for x in iterNdjsonBatches(lines, STREAM_BATCH_ROWS):
+                    with prioritySlot(priorityClass):
+                        y = predictInStages(model, x, observeStage)
+                    with timedStage(STAGE_ENCODE):
+                        encoded = encodeNdjson(y)
+                    yield encoded
+                    numRows += len(x)
+                    rowCounter.inc(len(x), endpoint="stream")
+            except PayloadError as e:
+                _log.warning(f"Aborting prediction stream after {numRows} rows: {e}")
+                yield dumpsJson({"error": str(e)}) + b"\n"
+                return
+            except Exception as e:
+                # the status line has already been sent, so the failure can only be signalled in the stream itself
+                _log.exception(f"Prediction stream failed after {numRows} rows")
+                yield dumpsJson({"error": f"Prediction failed: {e}"}) + b"\n"
+                return
+            _log.info(f"Streamed predictions for {numRows} rows")
+
+        return Response(stream_with_context(generatePredictions()), mimetype=NDJSON_MIMETYPE)
+
+
+@api.route('/api/v1/model', methods=['get'])
+class ModelInfo(Resource):
+    def get(self):
+        return modelRegistry.getInfo()
+
+
+def _getStoredModelRegistry(name: str, version: str) -> ModelRegistry:
+    if modelStore is None:
+        raise NotFound("No model directory is configured (MODEL_DIR)")
+    try:
+        return modelStore.getRegistry(name, version)
+    except ModelNotFound as e:
+        raise NotFound(str(e))
+
+
+@api.route('/api/v1/models', methods=['get'])
+class StoredModels(Resource):
+    @api.doc(description="Lists the models available in the model directory and the ones currently kept in memory")
+    def get(self):
+        if modelStore is None:
+            return {"enabled": False}
+        return modelStore.getInfo()
+
+
+@api.route('/api/v1/models/<string:name>/<string:version>/predict', methods=['post'])
+class StoredModelPredictor(Resource):
+    @api.expect(RESOURCE_FIELDS)
+    @api.doc(description="Applies the given version (or 'latest') of a model from the model directory; request and "
+                         "response formats are the same as for /api/v1/features. Models are loaded on first use and "
+                         "evicted (least recently used first) when the memory budget is exceeded.")
+    @withAdmissionControl
+    @withDeadline
+    def post(self, name: str, version: str):
+        return _servePrediction("models", _getStoredModelRegistry(name, version), modelTag=f"{name}/{version}")
+
+
+@api.route('/api/v1/cache', methods=['get'])
+class PredictionCacheStats(Resource):
+    def get(self):
+        return predictionCache.getStats() if predictionCache is not None else {"enabled": False}
+
+
+@api.route('/api/v1/shadow', methods=['get'])
+class ShadowStats(Resource):
+    def get(self):
+        return shadowScorer.getStats() if shadowScorer is not None else {"enabled": False}
+
+
+@api.route('/metrics', methods=['get'])
+class Metrics(Resource):
+    def get(self):
+        return Response(metricsRegistry.render(), content_type=PROMETHEUS_MIMETYPE)
+
+
+@api.route('/health/live', methods=['get'])
+class Liveness(Resource):
+    def get(self):
+        return {"status": "alive"}
+
 
-        x = model.predict(x)
-        x = jsonpickle.encode(x)
-        return jsonify(prediction=x)
+@api.route('/health/ready', methods=['get'])
+class Readiness(Resource):
+    @api.doc(description="Returns 200 once the model has been loaded and warmed up and 503 before; "
+                         "if loading has not been started yet, it is started in the background")
+    def get(self):
+        if modelRegistry.isLoaded():
+            return {"status": "ready", "version": modelRegistry.version}
+        modelRegistry.loadInBackground()
+        return {"status": "loading"}, 503
 
 
 if __name__ == '__main__':
+    modelRegistry.load()
+    checkFeatureTable()
+    if shadowScorer is not None:
+        shadowScorer.registry.tryLoad()
+    if fallbackRegistry is not None:
+        fallbackRegistry.tryLoad()
+    if modelWatcher is not None:
+        modelWatcher.ensureStarted()
     app.run(host=HOST, port=PORT)
 
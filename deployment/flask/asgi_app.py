@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+asyncio-based (ASGI) entry point for the prediction API, to be run with an ASGI server, e.g.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 20002
+
+Requests are read and decoded on the event loop, which can keep many mostly idle connections open without
+occupying threads. Predictions are offloaded to a bounded thread pool; requests beyond its capacity plus a bounded
+queue are rejected immediately with 503, and requests whose prediction does not finish in time (ASGI_TIMEOUT_SECS or
+the client's earlier deadline) receive 504.
+It serves the same model and payload formats as app.py.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import jsonpickle
+import pandas as pd
+
+from deadlines import Deadline, DeadlineExceeded, parseDeadline
+from inference import usePrecomputedEmbeddings
+from app import modelRegistry, predictDataFrame, DATA_TOKEN, DEADLINE_HEADER, TIMEOUT_HEADER
+from payload import ARROW_STREAM_MIMETYPE, COLUMNAR_JSON_MIMETYPE, PayloadError, decodeArrowStream, encodeArrowStream, \
+    decodeColumnarJson, encodeColumnarJson, decodeJsonPickle, isArrowSupported, loadsJson, dumpsJson
+
+# COLLECT ENV VARIABLES ###############
+ASGI_MAX_CONCURRENCY = int(os.environ.get('ASGI_MAX_CONCURRENCY', os.cpu_count() or 1))
+ASGI_MAX_QUEUED = int(os.environ.get('ASGI_MAX_QUEUED', 64))
+ASGI_TIMEOUT_SECS = float(os.environ.get('ASGI_TIMEOUT_SECS', 10))
+ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', 64 * 1024 * 1024))
+#######################################
+
+_log = logging.getLogger(__name__)
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: List[Tuple[bytes, bytes]] = ()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+class AsgiPredictionApp:
+    """
+    ASGI application offloading predictions to a bounded thread pool
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, maxConcurrency: int, maxQueued: int, timeoutSecs: float, maxBodyBytes: int):
+        """
+        :param maxConcurrency: the number of predictions which are computed concurrently
+        :param maxQueued: the number of requests which may wait for a free prediction slot; further requests are rejected
+        :param timeoutSecs: the time after which a request's prediction is abandoned (unless the client's deadline is
+            earlier)
+        :param maxBodyBytes: the maximum size of a request body
+        """
+        self.maxConcurrency = maxConcurrency
+        self.maxQueued = maxQueued
+        self.timeoutSecs = timeoutSecs
+        self.maxBodyBytes = maxBodyBytes
+        self._executor = ThreadPoolExecutor(max_workers=maxConcurrency, thread_name_prefix="predict")
+        self._numPending = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._handleLifespan(receive, send)
+        elif scope["type"] == "http":
+            try:
+                status, body, contentType, headers = await self._handleHttp(scope, receive)
+            except _HttpError as e:
+                status, body, contentType, headers = e.status, dumpsJson({"message": str(e)}), "application/json", e.headers
+            except Exception:
+                self._log.exception("Unhandled error while processing request")
+                status, body, contentType, headers = 500, dumpsJson({"message": "Internal server error"}), "application/json", []
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", contentType.encode()), *headers]})
+            await send({"type": "http.response.body", "body": body})
+
+    async def _handleLifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.get_event_loop().run_in_executor(self._executor, modelRegistry.load)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _handleHttp(self, scope, receive):
+        arrival = time.monotonic()
+        method, path = scope["method"], scope["path"]
+        if path == "/api/v1/model" and method == "GET":
+            return 200, dumpsJson(modelRegistry.getInfo()), "application/json", []
+        if path != "/api/v1/features":
+            raise _HttpError(404, f"No route for {path}")
+        if method != "POST":
+            raise _HttpError(405, f"Method {method} not allowed")
+
+        requestHeaders = dict(scope["headers"])
+        mimetype = requestHeaders.get(b"content-type", b"application/json").decode().split(";")[0].strip()
+        accept = requestHeaders.get(b"accept", b"").decode()
+        deadline = self._parseDeadline(requestHeaders, arrival)
+        body = await self._readBody(receive)
+        x = self._decode(mimetype, body)
+        y = await self._predict(x, deadline)
+        return self._encode(y, mimetype, accept)
+
+    def _parseDeadline(self, requestHeaders: dict, arrival: float) -> Deadline:
+        """
+        :return: the client's deadline (if given via header) or the server's timeout, whichever is earlier
+        """
+        def header(name: str):
+            value = requestHeaders.get(name.lower().encode())
+            return value.decode() if value is not None else None
+
+        try:
+            clientDeadline = parseDeadline(header(TIMEOUT_HEADER), header(DEADLINE_HEADER), arrival)
+        except ValueError:
+            raise _HttpError(400, f"{TIMEOUT_HEADER} and {DEADLINE_HEADER} have to be finite numbers")
+        return Deadline.earliest([clientDeadline, Deadline(arrival + self.timeoutSecs)])
+
+    async def _readBody(self, receive) -> bytes:
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise _HttpError(400, "Client disconnected")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > self.maxBodyBytes:
+                raise _HttpError(413, f"Request body exceeds {self.maxBodyBytes} bytes")
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    def _decode(mimetype: str, body: bytes) -> pd.DataFrame:
+        try:
+            if mimetype == ARROW_STREAM_MIMETYPE:
+                if not isArrowSupported():
+                    raise _HttpError(415, f"{ARROW_STREAM_MIMETYPE} requires pyarrow, which is not installed")
+                return decodeArrowStream(body)
+            if mimetype == COLUMNAR_JSON_MIMETYPE:
+                return decodeColumnarJson(body)
+            try:
+                content = loadsJson(body)
+            except ValueError:
+                raise PayloadError("The request body is not valid JSON")
+            if not isinstance(content, dict) or not isinstance(content.get(DATA_TOKEN), str):
+                raise PayloadError(f"Input payload validation failed: '{DATA_TOKEN}' is a required string property")
+            return decodeJsonPickle(content[DATA_TOKEN])
+        except PayloadError as e:
+            raise _HttpError(400, str(e))
+
+    @staticmethod
+    def _encode(y: pd.DataFrame, requestMimetype: str, accept: str):
+        acceptsRequestMimetype = not accept or requestMimetype in accept or "*/*" in accept
+        if requestMimetype == ARROW_STREAM_MIMETYPE and acceptsRequestMimetype:
+            return 200, encodeArrowStream(y), ARROW_STREAM_MIMETYPE, []
+        if requestMimetype == COLUMNAR_JSON_MIMETYPE and acceptsRequestMimetype:
+            return 200, encodeColumnarJson(y), COLUMNAR_JSON_MIMETYPE, []
+        return 200, dumpsJson({"prediction": jsonpickle.encode(y)}), "application/json", []
+
+    async def _predict(self, x: pd.DataFrame, deadline: Deadline) -> pd.DataFrame:
+        if self._numPending >= self.maxConcurrency + self.maxQueued:
+            raise _HttpError(503, "Too many pending predictions", headers=[(b"retry-after", b"1")])
+        loop = asyncio.get_event_loop()
+        self._numPending += 1
+        future = self._executor.submit(self._prepareAndPredict, x, deadline)
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._releasePending))
+        try:
+            # on timeout, the wrapped future is cancelled, which drops the prediction if it has not started yet
+            return await asyncio.wait_for(asyncio.wrap_future(future), max(0.0, deadline.remainingSecs()))
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            raise _HttpError(504, "Prediction did not finish before the request's deadline")
+        except PayloadError as e:
+            raise _HttpError(400, str(e))
+
+    @staticmethod
+    def _prepareAndPredict(x: pd.DataFrame, deadline: Deadline) -> pd.DataFrame:
+        try:
+            x = usePrecomputedEmbeddings(modelRegistry.getModel(), x)
+        except ValueError as e:
+            raise PayloadError(str(e))
+        return predictDataFrame(x, deadline=deadline)
+
+    def _releasePending(self):
+        self._numPending -= 1
+
+
+app = AsgiPredictionApp(ASGI_MAX_CONCURRENCY, ASGI_MAX_QUEUED, ASGI_TIMEOUT_SECS, ASGI_MAX_BODY_BYTES)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    from app import HOST, PORT
+    uvicorn.run(app, host=HOST or "0.0.0.0", port=PORT)
@@ -0,0 +1,186 @@
+import contextlib
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from deadlines import Deadline, DeadlineExceeded
+
+_log = logging.getLogger(__name__)
+
+StageCallback = Callable[[str, float], None]
+
+
+def _ignoreStage(stage: str, durationSecs: float):
+    pass
+
+
+class _PendingPrediction:
+    def __init__(self, df: pd.DataFrame, onStage: StageCallback, deadline: Optional[Deadline], priority: int):
+        self.df = df
+        self.priority = priority
+        self.onStage = onStage
+        self.deadline = deadline
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Collects prediction requests from concurrent callers for a short time window, applies the prediction function
+    once to the concatenation of their data frames and hands each caller the rows belonging to its input.
+    A batch is closed once it contains maxRows rows or maxWaitMs have passed since its first request arrived.
+    Inputs with differing columns are predicted in separate calls.
+    The stage durations reported by the prediction function for a batch are forwarded to all requests in the batch.
+    Requests whose deadline has passed or which were abandoned by their caller are dropped from the queue without
+    being predicted.
+    Queued requests are taken in the order of their priority (lower values first) and, within the same priority,
+    in the order of their arrival. If a slot function is given, each batch (and each input predicted directly) is
+    predicted within a slot for the highest priority it contains, so that concurrency limits apply to predictions
+    rather than to requests waiting in the queue.
+    The collecting thread only forms batches; they are predicted by worker threads, with a separate pool of
+    maxConcurrency workers per priority. Thus up to maxConcurrency batches of each priority are predicted at the same
+    time, and batches waiting for a slot of a lower priority never delay the batches of a higher one.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, predictFn: Callable[[pd.DataFrame, StageCallback, Optional[Deadline]], pd.DataFrame],
+                 maxRows: int, maxWaitMs: float,
+                 slot: Optional[Callable[[int, Optional[Deadline]], ContextManager]] = None, maxConcurrency: int = 1):
+        """
+        :param predictFn: function mapping an input data frame to a prediction data frame with the same number of rows,
+            which reports the durations of its stages to the given callback and may abort once the given deadline
+            (the latest deadline in the batch) has passed
+        :param maxRows: the number of rows after which a batch is closed; inputs with at least as many rows are
+            predicted directly in the calling thread
+        :param maxWaitMs: the maximum time to wait for further requests after the first request of a batch arrived
+        :param slot: function which receives a priority and a deadline and returns a context manager within which a
+            prediction is performed (e.g. waiting for a concurrency slot); it may raise DeadlineExceeded
+        :param maxConcurrency: the number of batches per priority which are predicted (or wait for their slot)
+            concurrently; it should match the concurrency limit applied by the slot function
+        """
+        self.predictFn = predictFn
+        self.maxRows = maxRows
+        self.maxWaitSecs = maxWaitMs / 1000
+        self.slot = slot
+        self.maxConcurrency = max(1, maxConcurrency)
+        self._queue: "queue.PriorityQueue[Tuple[int, int, _PendingPrediction]]" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._startLock = threading.Lock()
+        self._executors: Dict[int, ThreadPoolExecutor] = {}
+
+    def _ensureStarted(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._startLock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            # worker threads do not survive a fork, so a forked process gets its own pools
+            self._executors = {}
+            self._thread = threading.Thread(target=self._run, name="MicroBatcher", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def submit(self, df: pd.DataFrame, onStage: StageCallback = None, deadline: Optional[Deadline] = None,
+               priority: int = 0) -> "Future[pd.DataFrame]":
+        """
+        :param df: the input data frame
+        :param onStage: callback receiving the stage durations of the batch the input is predicted in
+        :param deadline: the deadline after which the input is no longer predicted
+        :param priority: the priority of the input, where lower values are taken from the queue first
+        :return: a future which resolves to the predictions for the rows of df (with df's index); cancelling it
+            before the batch is formed drops the input
+        """
+        self._ensureStarted()
+        pending = _PendingPrediction(df, onStage if onStage is not None else _ignoreStage, deadline, priority)
+        self._queue.put((priority, next(self._sequence), pending))
+        return pending.future
+
+    def predict(self, df: pd.DataFrame, onStage: StageCallback = None, deadline: Optional[Deadline] = None,
+                priority: int = 0) -> pd.DataFrame:
+        """
+        :raises DeadlineExceeded: if the deadline passes before the predictions are available
+        """
+        if len(df) >= self.maxRows:
+            with self._slot(priority, deadline):
+                return self.predictFn(df, onStage if onStage is not None else _ignoreStage, deadline)
+        future = self.submit(df, onStage, deadline, priority)
+        try:
+            return future.result(timeout=max(0.0, deadline.remainingSecs()) if deadline is not None else None)
+        except TimeoutError:
+            future.cancel()
+            raise DeadlineExceeded("Deadline exceeded while waiting for batched prediction")
+
+    def _slot(self, priority: int, deadline: Optional[Deadline]) -> ContextManager:
+        return self.slot(priority, deadline) if self.slot is not None else contextlib.nullcontext()
+
+    def numQueued(self) -> int:
+        return self._queue.qsize()
+
+    def _collectBatch(self) -> List[_PendingPrediction]:
+        batch = [self._queue.get()[2]]
+        numRows = len(batch[0].df)
+        batchDeadline = time.monotonic() + self.maxWaitSecs
+        while numRows < self.maxRows:
+            remainingSecs = batchDeadline - time.monotonic()
+            if remainingSecs <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remainingSecs)[2]
+            except queue.Empty:
+                break
+            batch.append(pending)
+            numRows += len(pending.df)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collectBatch()
+            groups = {}
+            for pending in batch:
+                if not pending.future.set_running_or_notify_cancel():
+                    continue
+                if pending.deadline is not None and pending.deadline.isExpired():
+                    pending.future.set_exception(DeadlineExceeded("Deadline exceeded while waiting in batching queue"))
+                    continue
+                groups.setdefault(tuple(pending.df.columns), []).append(pending)
+            for group in groups.values():
+                self._executor(min(pending.priority for pending in group)).submit(self._predictGroup, group)
+
+    def _executor(self, priority: int) -> ThreadPoolExecutor:
+        executor = self._executors.get(priority)
+        if executor is None:
+            executor = ThreadPoolExecutor(self.maxConcurrency, thread_name_prefix=f"MicroBatcher-{priority}")
+            self._executors[priority] = executor
+        return executor
+
+    def _predictGroup(self, group: List[_PendingPrediction]):
+        try:
+            x = pd.concat([pending.df for pending in group]) if len(group) > 1 else group[0].df
+            self._log.debug(f"Predicting batch of {len(x)} rows from {len(group)} requests")
+
+            def onStage(stage: str, durationSecs: float):
+                for pending in group:
+                    pending.onStage(stage, durationSecs)
+
+            deadline = Deadline.latest(pending.deadline for pending in group)
+            with self._slot(min(pending.priority for pending in group), deadline):
+                y = self.predictFn(x, onStage, deadline)
+            if len(y) != len(x):
+                raise ValueError(f"Prediction returned {len(y)} rows for {len(x)} input rows")
+        except Exception as e:
+            for pending in group:
+                pending.future.set_exception(e)
+            return
+        offset = 0
+        for pending in group:
+            numRows = len(pending.df)
+            pending.future.set_result(y.iloc[offset:offset + numRows])
+            offset += numRows
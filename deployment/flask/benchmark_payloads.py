@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Compares the server-side decoding and encoding cost of the payload formats accepted by /api/v1/features:
+the jsonpickle data frame embedded in JSON, the columnar JSON format and (if pyarrow is installed) Arrow IPC streams.
+The model itself is not involved; predictions are simulated by a data frame with one numeric column.
+
+    python benchmark_payloads.py --rows 1 100 10000
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Callable
+
+import jsonpickle
+import jsonpickle.ext.numpy as jsonpickle_numpy
+import numpy as np
+import pandas as pd
+
+from payload import decodeColumnarJson, encodeColumnarJson, decodeArrowStream, encodeArrowStream, isArrowSupported
+
+jsonpickle_numpy.register_handlers()
+
+
+def createReviews(numRows: int) -> pd.DataFrame:
+    rng = np.random.RandomState(42)
+    words = np.array(["great", "gift", "card", "easy", "to", "use", "would", "buy", "again", "not", "happy"])
+    texts = [" ".join(rng.choice(words, size=30)) for _ in range(numRows)]
+    index = [f"B00{i:07d}_A{i:09d}_1500000000" for i in range(numRows)]
+    return pd.DataFrame({"Gift_Amount": rng.randint(10, 100, size=numRows), "reviewText": texts}, index=index)
+
+
+def createPredictions(reviews: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({"overall": np.full(len(reviews), 5.0)}, index=reviews.index)
+
+
+def timeMs(fn: Callable, repetitions: int) -> float:
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+def benchmark(numRows: int, repetitions: int):
+    reviews = createReviews(numRows)
+    predictions = createPredictions(reviews)
+    jsonPickleBody = json.dumps({"data": jsonpickle.encode(reviews)}).encode("utf-8")
+    columnarBody = encodeColumnarJson(reviews)
+
+    def jsonPickleRoundTrip():
+        jsonpickle.decode(json.loads(jsonPickleBody)["data"])
+        json.dumps({"prediction": jsonpickle.encode(predictions)})
+
+    def columnarRoundTrip():
+        decodeColumnarJson(columnarBody)
+        encodeColumnarJson(predictions)
+
+    results = [("jsonpickle", len(jsonPickleBody), timeMs(jsonPickleRoundTrip, repetitions)),
+               ("columnar JSON", len(columnarBody), timeMs(columnarRoundTrip, repetitions))]
+    if isArrowSupported():
+        arrowBody = encodeArrowStream(reviews)
+
+        def arrowRoundTrip():
+            decodeArrowStream(arrowBody)
+            encodeArrowStream(predictions)
+
+        results.append(("Arrow IPC", len(arrowBody), timeMs(arrowRoundTrip, repetitions)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--repetitions", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'format':<15} {'request bytes':>14} {'decode+encode ms':>17}")
+    for numRows in args.rows:
+        for formatName, numBytes, durationMs in benchmark(numRows, args.repetitions):
+            print(f"{numRows:>8} {formatName:<15} {numBytes:>14} {durationMs:>17.3f}")
@@ -0,0 +1,87 @@
+import math
+import time
+from typing import Iterable, Optional
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """
+    A point in time (on the monotonic clock) after which the result of a request is no longer of use to the client
+    """
+    def __init__(self, expiresAt: float):
+        """
+        :param expiresAt: the expiry time in terms of time.monotonic()
+        """
+        self.expiresAt = expiresAt
+
+    @classmethod
+    def fromTimeout(cls, timeoutSecs: float) -> "Deadline":
+        return cls(time.monotonic() + timeoutSecs)
+
+    @classmethod
+    def fromUnixTime(cls, unixTime: float) -> "Deadline":
+        return cls(time.monotonic() + unixTime - time.time())
+
+    @staticmethod
+    def earliest(deadlines: Iterable[Optional["Deadline"]]) -> Optional["Deadline"]:
+        """
+        :return: the earliest of the given deadlines (ignoring None) or None if none of them is bounded
+        """
+        deadlines = [d for d in deadlines if d is not None]
+        return min(deadlines, key=lambda d: d.expiresAt) if deadlines else None
+
+    @staticmethod
+    def latest(deadlines: Iterable[Optional["Deadline"]]) -> Optional["Deadline"]:
+        """
+        :return: the latest of the given deadlines or None if any of them is None (i.e. unbounded)
+        """
+        deadlines = list(deadlines)
+        if not deadlines or any(d is None for d in deadlines):
+            return None
+        return max(deadlines, key=lambda d: d.expiresAt)
+
+    def remainingSecs(self) -> float:
+        return self.expiresAt - time.monotonic()
+
+    def isExpired(self) -> bool:
+        return self.remainingSecs() <= 0
+
+    def check(self, stage: str):
+        """
+        :param stage: the stage which is about to begin
+        :raises DeadlineExceeded: if the deadline has passed
+        """
+        remainingSecs = self.remainingSecs()
+        if remainingSecs <= 0:
+            raise DeadlineExceeded(f"Deadline exceeded by {-remainingSecs * 1000:.1f}ms before {stage}")
+
+
+def checkDeadline(deadline: Optional[Deadline], stage: str):
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def parseDeadline(timeoutMs: Optional[str], unixDeadline: Optional[str], arrival: float) -> Optional[Deadline]:
+    """
+    :param timeoutMs: the value of a header giving the deadline relative to the request's arrival in milliseconds
+    :param unixDeadline: the value of a header giving the deadline as an absolute unix timestamp in seconds
+    :param arrival: the arrival time of the request in terms of time.monotonic()
+    :return: the deadline given by timeoutMs or, if it is None, by unixDeadline; None if both are None
+    :raises ValueError: if the given value is not a finite number
+    """
+    if timeoutMs is not None:
+        return Deadline(arrival + _parseFinite(timeoutMs) / 1000)
+    if unixDeadline is not None:
+        return Deadline.fromUnixTime(_parseFinite(unixDeadline))
+    return None
+
+
+def _parseFinite(value: str) -> float:
+    # float accepts "nan" and "inf", which would result in deadlines that never expire
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"Not a finite number: {value}")
+    return number
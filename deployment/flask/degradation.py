@@ -0,0 +1,131 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+from model_registry import ModelRegistry
+
+_log = logging.getLogger(__name__)
+
+
+class FallbackRouter:
+    """
+    Decides whether a request is served by a cheaper fallback model instead of the primary model. While the load
+    signal indicates overload (the number of queued requests or the 95th percentile of recent primary latencies
+    exceeds its threshold), a configurable share of the requests is routed to the fallback model. Fallback predictions
+    run within their own small concurrency budget (see tryAcquireSlot) rather than in the primary model's queues.
+    The fallback model is loaded in the background when the router is first consulted and is only used once it is
+    loaded; after a failed load, loading is retried no earlier than loadRetryIntervalSecs later.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, fallbackRegistry: ModelRegistry, fraction: float, maxQueueDepth: int,
+                 queueDepthFns: Sequence[Callable[[], int]], p95LatencyMs: Optional[float] = None,
+                 latencyWindowSecs: float = 30, maxConcurrency: int = 2, loadRetryIntervalSecs: float = 60,
+                 maxLatencySamples: int = 100000, p95RefreshSecs: float = 0.25):
+        """
+        :param fallbackRegistry: the registry holding the fallback model
+        :param fraction: the share of requests routed to the fallback model under overload
+        :param maxQueueDepth: the number of queued requests from which on the service counts as overloaded
+        :param queueDepthFns: functions returning the numbers of requests waiting in the service's queues
+        :param p95LatencyMs: the 95th percentile of primary latencies above which the service counts as overloaded;
+            if None, latencies are not considered
+        :param latencyWindowSecs: the age up to which primary latencies are considered; older ones are dropped, so
+            the latency signal clears once the primary model no longer receives (slow) requests
+        :param maxConcurrency: the number of fallback predictions which may run concurrently
+        :param loadRetryIntervalSecs: the minimum time between attempts to load the fallback model
+        :param maxLatencySamples: the maximum number of latencies kept; if more requests complete within the latency
+            window, only the most recent ones are considered, which bounds the memory and the time of computing the
+            percentile
+        :param p95RefreshSecs: the time for which a computed 95th percentile is reused before it is recomputed
+        """
+        self.fallbackRegistry = fallbackRegistry
+        self.fraction = fraction
+        self.maxQueueDepth = maxQueueDepth
+        self.queueDepthFns = list(queueDepthFns)
+        self.p95LatencySecs = p95LatencyMs / 1000 if p95LatencyMs is not None else None
+        self.latencyWindowSecs = latencyWindowSecs
+        self.maxConcurrency = maxConcurrency
+        self.loadRetryIntervalSecs = loadRetryIntervalSecs
+        self.p95RefreshSecs = p95RefreshSecs
+        self._latencies = deque(maxlen=maxLatencySamples)  # pairs (time.monotonic(), latency in seconds)
+        self._p95LatencySecs: Optional[float] = None
+        self._p95ComputedAt: Optional[float] = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxConcurrency)
+        self._degraded = False
+
+    def recordPrimaryLatency(self, latencySecs: float):
+        with self._lock:
+            self._latencies.append((time.monotonic(), latencySecs))
+
+    def getQueueDepth(self) -> int:
+        return sum(fn() for fn in self.queueDepthFns)
+
+    def getP95LatencySecs(self) -> Optional[float]:
+        """
+        :return: the 95th percentile of the primary latencies recorded within the latency window (as of at most
+            p95RefreshSecs ago) or None if there are none
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._p95ComputedAt is not None and now - self._p95ComputedAt < self.p95RefreshSecs:
+                return self._p95LatencySecs
+            while self._latencies and self._latencies[0][0] < now - self.latencyWindowSecs:
+                self._latencies.popleft()
+            latencies = np.fromiter((latencySecs for _, latencySecs in self._latencies), dtype=float,
+                                    count=len(self._latencies))
+            self._p95LatencySecs = float(np.percentile(latencies, 95)) if len(latencies) > 0 else None
+            self._p95ComputedAt = now
+            return self._p95LatencySecs
+
+    def isOverloaded(self) -> bool:
+        if self.getQueueDepth() >= self.maxQueueDepth:
+            return True
+        if self.p95LatencySecs is not None:
+            p95 = self.getP95LatencySecs()
+            return p95 is not None and p95 > self.p95LatencySecs
+        return False
+
+    def _updateState(self, overloaded: bool):
+        if overloaded != self._degraded:
+            self._degraded = overloaded
+            if overloaded:
+                self._log.warning(f"Overload detected (queue depth {self.getQueueDepth()}, p95 latency "
+                                  f"{self.getP95LatencySecs()}s); routing {self.fraction * 100:.0f}% of requests to "
+                                  f"the fallback model")
+            else:
+                self._log.info("Load back to normal; serving all requests with the primary model")
+
+    def isFallbackAvailable(self) -> bool:
+        if self.fallbackRegistry.isLoaded():
+            return True
+        self.fallbackRegistry.loadInBackground(retryIntervalSecs=self.loadRetryIntervalSecs)
+        return False
+
+    def shouldUseFallback(self) -> bool:
+        """
+        :return: whether the current request shall be served by the fallback model
+        """
+        overloaded = self.isOverloaded()
+        self._updateState(overloaded)
+        return overloaded and random.random() < self.fraction and self.isFallbackAvailable()
+
+    def tryAcquireSlot(self) -> bool:
+        """
+        Takes one of the fallback model's concurrency slots without waiting. Every successful call must be followed by
+        a call to releaseSlot.
+
+        :return: whether a slot was available
+        """
+        return self._slots.acquire(blocking=False)
+
+    def releaseSlot(self):
+        self._slots.release()
+
+    def isDegraded(self) -> bool:
+        return self._degraded
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Exports a pickled review classifier (as produced by preprocessing/emr/cleaning_spark.py) to TorchScript for the lean
+serving backend (MODEL_BACKEND=torchscript) and checks that the exported graph is numerically equivalent to the
+original model: the class probabilities computed from the same features must agree within --atol, and the
+end-to-end predictions (with the backend's batched sentence encoding) are compared as well. Per-call latencies of
+both backends are reported. The graph and its metadata are written to a temporary directory and only moved to the
+output path if the check passes, so a non-equivalent export never replaces a served artifact.
+
+    python export_torchscript.py reviewClassifier-v1.pickle reviewClassifier-v1.pt --data heldout.parquet
+"""
+import argparse
+import logging
+import os
+import pickle
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from torchscript_backend import DEFAULT_ENCODER_NAME, TorchScriptReviewClassifier, exportTorchScript, getMetadataPath
+
+_log = logging.getLogger(__name__)
+
+SAMPLE_TEXTS = ["This gift card was easy to use and arrived right on time.",
+                "Terrible experience, the code did not work and support never answered.",
+                "It is a gift card. Does what it says.",
+                "My niece loved it, will buy again for birthdays!"]
+
+
+def readSample(path: str, indexColumn: str, textColumn: str, numRows: int) -> pd.DataFrame:
+    if path is None:
+        texts = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] for i in range(numRows)]
+        return pd.DataFrame({textColumn: texts}, index=[f"sample_{i}" for i in range(numRows)])
+    df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    return df.set_index(indexColumn, drop=True).dropna().head(numRows)
+
+
+def medianMs(fn: Callable, repetitions: int) -> float:
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help="path of the pickled model")
+    parser.add_argument("output", help="path of the TorchScript file; the metadata is written next to it (.json)")
+    parser.add_argument("--encoder", default=DEFAULT_ENCODER_NAME, help="name of the model's sentence transformer")
+    parser.add_argument("--data", default=None, help="CSV or Parquet file with inputs for the equivalence check")
+    parser.add_argument("--index-column", default="identifier")
+    parser.add_argument("--rows", type=int, default=200, help="number of rows used for the equivalence check")
+    parser.add_argument("--atol", type=float, default=1e-5, help="tolerance for the class probabilities")
+    parser.add_argument("--repetitions", type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.model, 'rb') as f:
+        model = pickle.load(f)
+    outputPath = os.path.abspath(args.output)
+    tmpDir = tempfile.mkdtemp(prefix=".export-", dir=os.path.dirname(outputPath))
+    try:
+        tmpPath = os.path.join(tmpDir, os.path.basename(outputPath))
+        exportTorchScript(model, tmpPath, encoderName=args.encoder)
+        backend = TorchScriptReviewClassifier.load(tmpPath)
+
+        x = readSample(args.data, args.index_column, backend.textColumn, args.rows)
+        inputs = model._computeInputs(x)
+        expected = model._predictClassProbabilities(inputs).values
+        actual = backend.predictClassProbabilities(inputs.values.astype(np.float32))
+        maxDiff = float(np.max(np.abs(expected - actual)))
+        agreement = float(np.mean(model.predict(x).values[:, 0] == backend.predict(x).values[:, 0]))
+        print(f"Maximum absolute difference of class probabilities on {len(x)} rows: {maxDiff:.2e} (tolerance {args.atol})")
+        print(f"End-to-end predictions agree on {agreement * 100:.2f}% of rows")
+
+        single = x.head(1)
+        print(f"{'backend':<12} {'1 row ms':>9} {f'{len(x)} rows ms':>14}")
+        for name, predict in (("sensai", model.predict), ("torchscript", backend.predict)):
+            print(f"{name:<12} {medianMs(lambda: predict(single), args.repetitions):>9.3f} "
+                  f"{medianMs(lambda: predict(x), max(1, args.repetitions // 5)):>14.3f}")
+
+        if maxDiff > args.atol:
+            _log.error(f"Exported graph is not equivalent to the original model within tolerance; {args.output} "
+                       f"was not written")
+            sys.exit(1)
+        # the metadata is moved first, such that a service watching the graph file finds matching metadata
+        os.replace(getMetadataPath(tmpPath), getMetadataPath(outputPath))
+        os.replace(tmpPath, outputPath)
+        _log.info(f"Wrote {outputPath} and {getMetadataPath(outputPath)}")
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
@@ -0,0 +1,216 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from sensai.featuregen import FeatureGenerator, FeatureGeneratorFromColumnGenerator
+from sensai.vector_model import VectorModel
+
+from deadlines import Deadline, checkDeadline
+from payload import EMBEDDINGS_COLUMN
+
+_log = logging.getLogger(__name__)
+
+STAGE_FEATURE_GENERATION = "feature_generation"
+STAGE_PREDICT = "predict"
+
+
+def predictInStages(model: VectorModel, x: pd.DataFrame, onStage: Callable[[str, float], None],
+                    deadline: Optional[Deadline] = None) -> pd.DataFrame:
+    """
+    Applies the model like VectorModel.predict but reports the durations of feature generation (including input
+    transformation) and of the application of the underlying model (e.g. the MLP forward pass) separately.
+    Models which are not sensAI vector models are applied via predict, which is reported as a single stage.
+
+    :param model: the model
+    :param x: the input data frame
+    :param onStage: function which is called with the name and duration (in seconds) of each completed stage
+    :param deadline: if given, the deadline is checked before each stage, raising DeadlineExceeded if it has passed
+    :return: the predictions
+    """
+    checkDeadline(deadline, STAGE_FEATURE_GENERATION)
+    if not isinstance(model, VectorModel):
+        start = time.perf_counter()
+        y = model.predict(x)
+        onStage(STAGE_PREDICT, time.perf_counter() - start)
+        return y
+
+    start = time.perf_counter()
+    inputs = model._computeInputs(x)
+    onStage(STAGE_FEATURE_GENERATION, time.perf_counter() - start)
+    return predictFromInputs(model, inputs, onStage, deadline)
+
+
+def getInputColumns(model) -> List[str]:
+    """
+    :param model: a sensAI vector model or a TorchScriptReviewClassifier
+    :return: the names of the model inputs (after feature generation), in the order the model expects them
+    """
+    return list(model.inputColumns) if hasattr(model, "inputColumns") else list(model._modelInputVariableNames)
+
+
+def predictFromInputs(model: VectorModel, inputs: pd.DataFrame, onStage: Callable[[str, float], None],
+                      deadline: Optional[Deadline] = None) -> pd.DataFrame:
+    """
+    Applies the model to inputs which have already been generated (i.e. model inputs as computed by
+    VectorModel._computeInputs, for example read from a feature table), skipping feature generation
+
+    :param model: the model
+    :param inputs: the model inputs
+    :param onStage: function which is called with the name and duration (in seconds) of the predict stage
+    :param deadline: if given, the deadline is checked before the prediction
+    :return: the predictions
+    """
+    checkDeadline(deadline, STAGE_PREDICT)
+    start = time.perf_counter()
+    y = model._predict(inputs)
+    y.index = inputs.index
+    y = model._outputTransformerChain.apply(y)
+    if model._targetTransformer is not None:
+        y = model._targetTransformer.applyInverse(y)
+    onStage(STAGE_PREDICT, time.perf_counter() - start)
+    return y
+
+
+class ChunkedPredictor:
+    """
+    Predicts large inputs in chunks of rows which are processed in parallel on a bounded thread pool (shared by all
+    requests) and reassembled in order. This bounds the memory required for intermediate results (e.g. BERT
+    activations) by the number of workers times the chunk size and lets torch, which releases the GIL, use several
+    cores for a single request. The deadline is checked before each chunk's stages, so the remaining chunks of an
+    abandoned request are skipped.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, chunkRows: int, maxWorkers: int, torchThreads: int = 0):
+        """
+        :param chunkRows: the number of rows per chunk; inputs with at most as many rows are predicted directly
+        :param maxWorkers: the number of chunks predicted concurrently
+        :param torchThreads: if positive, the number of intra-op threads torch uses (set when the pool is created);
+            as this is a process-wide setting, it should be about the number of cores divided by maxWorkers
+        """
+        self.chunkRows = chunkRows
+        self.maxWorkers = maxWorkers
+        self.torchThreads = torchThreads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _getExecutor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pid != os.getpid():
+                if self.torchThreads > 0:
+                    import torch
+                    torch.set_num_threads(self.torchThreads)
+                self._executor = ThreadPoolExecutor(max_workers=self.maxWorkers, thread_name_prefix="ChunkedPredictor")
+                self._pid = os.getpid()
+            return self._executor
+
+    def predict(self, model: VectorModel, x: pd.DataFrame, onStage: Callable[[str, float], None],
+                deadline: Optional[Deadline] = None) -> pd.DataFrame:
+        """
+        Applies predictInStages to the chunks of x; onStage is called for every chunk (from the pool's threads)
+        """
+        if len(x) <= self.chunkRows:
+            return predictInStages(model, x, onStage, deadline)
+        executor = self._getExecutor()
+        futures = [executor.submit(predictInStages, model, x.iloc[start:start + self.chunkRows], onStage, deadline)
+                   for start in range(0, len(x), self.chunkRows)]
+        self._log.debug(f"Predicting {len(x)} rows in {len(futures)} chunks")
+        try:
+            return pd.concat([future.result() for future in futures])
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def iterFeatureGenerators(featureGenerator: Optional[FeatureGenerator]) -> Iterator[FeatureGenerator]:
+    """
+    :return: the given feature generator and all feature generators nested in it (e.g. in multi or chained generators)
+    """
+    if featureGenerator is None:
+        return
+    yield featureGenerator
+    for child in getattr(featureGenerator, "featureGenerators", ()):
+        yield from iterFeatureGenerators(child)
+
+
+def findSentenceEncodingGenerators(model: VectorModel) -> List[FeatureGeneratorFromColumnGenerator]:
+    """
+    :return: the model's feature generators which compute sentence encodings of a text column (via
+        models.utils.ColumnGeneratorSentenceEncodings)
+    """
+    return [fg for fg in iterFeatureGenerators(model.getFeatureGenerator())
+            if isinstance(fg, FeatureGeneratorFromColumnGenerator) and hasattr(fg.columnGen, "columnToEncode")]
+
+
+def enablePrecomputedEncodings(model: VectorModel):
+    """
+    Makes the model's sentence encoding feature generators take the encoding column (e.g. reviewTextEncoded) from the
+    input data frame if it is present, such that the sentence encoder is skipped for inputs with precomputed
+    embeddings
+    """
+    for fg in findSentenceEncodingGenerators(model):
+        fg.takeInputColumnIfPresent = True
+
+
+def getEncodingDimensions(model: VectorModel) -> Dict[str, int]:
+    """
+    :return: a mapping from the names of the model's sentence encoding columns to their dimensions (as given by the
+        number of flattened input columns <name>_<i> of the model)
+    """
+    inputNames = model._modelInputVariableNames or []
+    result = {}
+    for fg in findSentenceEncodingGenerators(model):
+        columnName = fg.columnGen.generatedColumnName
+        result[columnName] = sum(1 for name in inputNames if name.startswith(f"{columnName}_"))
+    return result
+
+
+def usePrecomputedEmbeddings(model: VectorModel, x: pd.DataFrame) -> pd.DataFrame:
+    """
+    Renames the column EMBEDDINGS_COLUMN (if present) to the model's sentence encoding column and checks the precomputed
+    encodings in x. Models which are not sensAI vector models (i.e. the TorchScript backend) take EMBEDDINGS_COLUMN
+    directly and only have their embeddings checked (via checkEmbeddings).
+
+    :param model: a model prepared via enablePrecomputedEncodings or a model providing checkEmbeddings
+    :param x: the input data frame
+    :return: the input data frame with the model's encoding column
+    :raises ValueError: if the embeddings cannot be used by the model
+    """
+    if not isinstance(model, VectorModel):
+        if hasattr(model, "checkEmbeddings"):
+            model.checkEmbeddings(x)
+        return x
+    dimensions = getEncodingDimensions(model)
+    if EMBEDDINGS_COLUMN in x.columns:
+        if len(dimensions) != 1:
+            raise ValueError(f"Embeddings can only be passed without column name to models with exactly one sentence "
+                             f"encoding, the model has {len(dimensions)}")
+        x = x.rename(columns={EMBEDDINGS_COLUMN: next(iter(dimensions))})
+    for columnName, dimension in dimensions.items():
+        if columnName not in x.columns:
+            continue
+        for vector in x[columnName].values:
+            if vector is None or np.ndim(vector) != 1 or len(vector) != dimension:
+                raise ValueError(f"Each row of {columnName} has to contain an embedding with {dimension} values")
+    return x
+
+
+def warmUp(model: VectorModel, x: pd.DataFrame, iterations: int):
+    """
+    Applies the model to the given input repeatedly, such that lazily initialised resources (torch kernels and thread
+    pools, paged-in encoder weights, feature caches) are set up before real requests arrive
+
+    :param model: the model
+    :param x: a representative input data frame
+    :param iterations: the number of predictions to perform
+    """
+    for i in range(iterations):
+        start = time.perf_counter()
+        model.predict(x)
+        _log.debug(f"Warm-up prediction {i + 1}/{iterations} for {len(x)} rows took {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Local inference endpoint for services on the same host. Control messages are exchanged as JSON lines over a Unix
+domain socket, while input feature vectors and output class probabilities are passed in memory-mapped files in a
+shared memory directory (/dev/shm by default), such that batches are neither serialised nor copied through the socket.
+
+Protocol (one JSON object per line in each direction):
+
+    {"op": "info"}
+        -> {"inputColumns": [...], "labels": [...]}
+    {"op": "predict", "input": "<file>", "output": "<file>", "rows": n, "priority": "bulk"}
+        -> {"rows": n} once the output file holds the class probabilities
+
+where input is a float32 matrix of shape (n, len(inputColumns)) with the model inputs (e.g. sentence embeddings) and
+output is a float32 matrix of shape (n, len(labels)), both in C order and located in the shared memory directory.
+Both have to be files created by SharedArray (review-ipc-*.f32) of exactly the matrix's size. Errors are answered
+with {"error": "<message>"}. LocalInferenceClient implements the client side.
+
+    python local_ipc.py --socket /tmp/review-classifier.sock
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+from sensai.vector_model import VectorModel
+
+from inference import getInputColumns
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SHM_DIR = "/dev/shm"
+# the server usually runs as a different user than its clients, so shared arrays are readable and writable by the
+# group (the client and the server have to share a group)
+DEFAULT_FILE_MODE = 0o660
+SHARED_ARRAY_PREFIX = "review-ipc-"
+SHARED_ARRAY_SUFFIX = ".f32"
+
+
+def getLabels(model) -> list:
+    labels = model.labels if hasattr(model, "labels") else model._labels
+    return [label.item() if isinstance(label, np.generic) else label for label in labels]
+
+
+def predictClassProbabilities(model, inputs: np.ndarray) -> np.ndarray:
+    """
+    :param model: a sensai classification model or a TorchScriptReviewClassifier
+    :param inputs: the model inputs (after feature generation)
+    :return: the class probabilities (one column per label)
+    """
+    if isinstance(model, VectorModel):
+        return model._predictClassProbabilities(pd.DataFrame(inputs, columns=getInputColumns(model))).values
+    return model.predictClassProbabilities(inputs)
+
+
+def mapSharedArray(path: str, rows: int, columns: int, mode: str) -> np.memmap:
+    return np.memmap(path, dtype=np.float32, mode=mode, shape=(rows, columns))
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "LocalInferenceServer"
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.handleMessage(json.loads(line))
+            except Exception as e:
+                self.server._log.warning(f"Failed to handle local request: {e}")
+                response = {"error": str(e)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class LocalInferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves class probabilities for batches of model inputs passed in shared memory files (see the module docstring
+    for the protocol). Each connection is handled in its own thread.
+    """
+    _log = _log.getChild(__qualname__)
+    daemon_threads = True
+
+    def __init__(self, socketPath: str, getModel: Callable[[], object], shmDir: str = DEFAULT_SHM_DIR,
+                 runPrediction: Optional[Callable[[str, Callable[[], None]], None]] = None):
+        """
+        :param socketPath: the path of the Unix socket, which is replaced if it exists
+        :param getModel: function returning the current model
+        :param shmDir: the directory in which input and output files have to be located
+        :param runPrediction: function which receives a priority class and a prediction function and runs it (e.g.
+            within a concurrency budget); if None, predictions run directly in the connection's thread
+        """
+        if os.path.exists(socketPath):
+            os.unlink(socketPath)
+        self.socketPath = socketPath
+        self.getModel = getModel
+        self.shmDir = os.path.realpath(shmDir)
+        self.runPrediction = runPrediction if runPrediction is not None else lambda priority, fn: fn()
+        super().__init__(socketPath, _RequestHandler)
+
+    def _resolveSharedPath(self, path: str, rows: int, columns: int) -> str:
+        """
+        Checks that the given path refers to a shared array (as created by SharedArray) with the given shape, such that
+        clients cannot make the server overwrite or extend other files the server's user has access to
+
+        :return: the resolved path
+        :raises ValueError: if the path is not a shared array of the given shape
+        """
+        resolved = os.path.realpath(path)
+        name = os.path.basename(resolved)
+        if os.path.dirname(resolved) != self.shmDir or not name.startswith(SHARED_ARRAY_PREFIX) \
+                or not name.endswith(SHARED_ARRAY_SUFFIX) or not os.path.isfile(resolved):
+            raise ValueError(f"Shared arrays have to be files {SHARED_ARRAY_PREFIX}*{SHARED_ARRAY_SUFFIX} in "
+                             f"{self.shmDir}")
+        size = os.path.getsize(resolved)
+        if size != rows * columns * 4:
+            raise ValueError(f"Shared array {name} has {size} bytes instead of {rows * columns * 4} for a "
+                             f"{rows}x{columns} float32 matrix")
+        return resolved
+
+    def handleMessage(self, message: dict) -> dict:
+        op = message.get("op")
+        model = self.getModel()
+        if op == "info":
+            return {"inputColumns": getInputColumns(model), "labels": getLabels(model)}
+        if op != "predict":
+            raise ValueError(f"Unknown op: {op}")
+        rows = int(message["rows"])
+        if rows < 0:
+            raise ValueError(f"Invalid number of rows: {rows}")
+        if rows == 0:
+            return {"rows": 0}
+        numInputColumns, numLabels = len(getInputColumns(model)), len(getLabels(model))
+        inputs = mapSharedArray(self._resolveSharedPath(message["input"], rows, numInputColumns), rows,
+                                numInputColumns, 'r')
+        outputs = mapSharedArray(self._resolveSharedPath(message["output"], rows, numLabels), rows, numLabels, 'r+')
+
+        def predict():
+            outputs[:] = predictClassProbabilities(model, inputs)
+            outputs.flush()
+
+        self.runPrediction(message.get("priority", "bulk"), predict)
+        return {"rows": rows}
+
+
+class SharedArray:
+    """
+    A float32 matrix in a memory-mapped file in the shared memory directory, which the client writes inputs to and reads
+    outputs from without copying them through the socket. The file is removed when the array is closed.
+    """
+    def __init__(self, rows: int, columns: int, shmDir: str = DEFAULT_SHM_DIR, fileMode: int = DEFAULT_FILE_MODE):
+        """
+        :param rows: the number of rows
+        :param columns: the number of columns
+        :param shmDir: the directory to create the file in
+        :param fileMode: the permissions of the file (mkstemp creates files which only their owner can access)
+        """
+        fd, self.path = tempfile.mkstemp(prefix=SHARED_ARRAY_PREFIX, suffix=SHARED_ARRAY_SUFFIX, dir=shmDir)
+        os.fchmod(fd, fileMode)
+        os.ftruncate(fd, max(1, rows * columns * 4))
+        os.close(fd)
+        self.array = mapSharedArray(self.path, rows, columns, 'r+') if rows > 0 \
+            else np.zeros((0, columns), dtype=np.float32)
+
+    def close(self):
+        self.array = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class LocalInferenceClient:
+    """
+    Client of LocalInferenceServer. The connection is kept open and may be used by several threads (one request at
+    a time). For zero-copy use, write inputs directly into an array obtained via allocateInputs.
+    """
+    def __init__(self, socketPath: str, shmDir: str = DEFAULT_SHM_DIR, fileMode: int = DEFAULT_FILE_MODE):
+        """
+        :param socketPath: the path of the server's Unix socket
+        :param shmDir: the shared memory directory the server accepts files in
+        :param fileMode: the permissions of the shared arrays, which the server's user has to be able to read and write
+        """
+        self.shmDir = shmDir
+        self.fileMode = fileMode
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socketPath)
+        self._file = self._socket.makefile("rwb")
+        self._lock = threading.Lock()
+        info = self._call({"op": "info"})
+        self.inputColumns: List[str] = info["inputColumns"]
+        self.labels: list = info["labels"]
+
+    def _call(self, message: dict) -> dict:
+        with self._lock:
+            self._file.write(json.dumps(message).encode("utf-8") + b"\n")
+            self._file.flush()
+            response = json.loads(self._file.readline())
+        if "error" in response:
+            raise RuntimeError(f"Local inference failed: {response['error']}")
+        return response
+
+    def allocateInputs(self, rows: int) -> SharedArray:
+        return SharedArray(rows, len(self.inputColumns), self.shmDir, self.fileMode)
+
+    def predictClassProbabilities(self, inputs, priority: str = "bulk") -> np.ndarray:
+        """
+        :param inputs: a SharedArray obtained via allocateInputs or a matrix with one column per input column
+            (which is copied into shared memory once)
+        :param priority: the priority class of the request (interactive or bulk)
+        :return: the class probabilities, one column per label
+        """
+        if not isinstance(inputs, SharedArray):
+            matrix = np.asarray(inputs, dtype=np.float32)
+            with self.allocateInputs(len(matrix)) as shared:
+                shared.array[:] = matrix
+                return self.predictClassProbabilities(shared, priority=priority)
+        rows = len(inputs.array)
+        with SharedArray(rows, len(self.labels), self.shmDir, self.fileMode) as outputs:
+            self._call({"op": "predict", "input": inputs.path, "output": outputs.path, "rows": rows,
+                        "priority": priority})
+            return np.array(outputs.array)
+
+    def predict(self, inputs, priority: str = "bulk") -> np.ndarray:
+        """
+        :return: the predicted label of each row
+        """
+        probabilities = self.predictClassProbabilities(inputs, priority=priority)
+        return np.array(self.labels)[np.argmax(probabilities, axis=1)]
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+if __name__ == '__main__':
+    from app import get_model, modelRegistry, prioritySlot
+    from priority import PRIORITY_CLASSES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.environ.get('LOCAL_IPC_SOCKET', '/tmp/review-classifier.sock'))
+    parser.add_argument("--shm-dir", default=os.environ.get('LOCAL_IPC_SHM_DIR', DEFAULT_SHM_DIR))
+    args = parser.parse_args()
+
+    def runPrediction(priorityClass: str, fn: Callable[[], None]):
+        if priorityClass not in PRIORITY_CLASSES:
+            raise ValueError(f"priority has to be one of {', '.join(PRIORITY_CLASSES)}")
+        with prioritySlot(priorityClass):
+            fn()
+
+    modelRegistry.load()
+    server = LocalInferenceServer(args.socket, get_model, shmDir=args.shm_dir, runPrediction=runPrediction)
+    _log.info(f"Serving local inference on {args.socket} with shared arrays in {args.shm_dir}")
+    server.serve_forever()
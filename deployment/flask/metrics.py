@@ -0,0 +1,158 @@
+"""
+Minimal in-process metrics (counters, gauges and histograms) rendered in the Prometheus text exposition format.
+Metrics are kept per process; with several worker processes, each worker reports its own values.
+"""
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _formatLabels(labelNames: Sequence[str], labelValues: Sequence[str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(labelNames, labelValues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    typeName = None
+
+    def __init__(self, name: str, description: str, labelNames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelNames = tuple(labelNames)
+        self._lock = threading.Lock()
+
+    def _labelValues(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelNames):
+            raise ValueError(f"Metric {self.name} requires the labels {self.labelNames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelNames)
+
+    def _renderSamples(self) -> List[str]:
+        raise NotImplementedError()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.typeName}"] + self._renderSamples()
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count which is either incremented explicitly or, if a function is given, read from
+    the function (e.g. a count maintained by another component) whenever the metrics are rendered
+    """
+    typeName = "counter"
+
+    def __init__(self, name: str, description: str, labelNames: Sequence[str] = (),
+                 fn: Optional[Callable[[], float]] = None):
+        if fn is not None and labelNames:
+            raise ValueError("Counters read from a function cannot have labels")
+        super().__init__(name, description, labelNames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._fn = fn
+
+    def inc(self, amount: float = 1, **labels):
+        if self._fn is not None:
+            raise ValueError(f"Counter {self.name} is read from a function and cannot be incremented")
+        key = self._labelValues(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def getValue(self, **labels) -> float:
+        if self._fn is not None:
+            return self._fn()
+        return self._values.get(self._labelValues(labels), 0)
+
+    def _renderSamples(self):
+        if self._fn is not None:
+            return [f"{self.name} {self._fn()}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_formatLabels(self.labelNames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    A gauge which is either set explicitly or, if a function is given, evaluated whenever the metrics are rendered
+    """
+    typeName = "gauge"
+
+    def __init__(self, name: str, description: str, fn: Optional[Callable[[], Optional[float]]] = None):
+        super().__init__(name, description)
+        self._fn = fn
+        self._value = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def getValue(self) -> Optional[float]:
+        return self._fn() if self._fn is not None else self._value
+
+    def _renderSamples(self):
+        value = self.getValue()
+        return [] if value is None else [f"{self.name} {value}"]
+
+
+class Histogram(_Metric):
+    typeName = "histogram"
+
+    def __init__(self, name: str, description: str, labelNames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, description, labelNames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._labelValues(labels)
+        bucketIndex = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[bucketIndex] += 1
+            self._sums[key] += value
+
+    def _renderSamples(self):
+        lines = []
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        for key, counts, total in items:
+            cumulativeCount = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulativeCount += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_formatLabels(self.labelNames, key, (('le', le),))} {cumulativeCount}")
+            lines.append(f"{self.name}_sum{_formatLabels(self.labelNames, key)} {total}")
+            lines.append(f"{self.name}_count{_formatLabels(self.labelNames, key)} {cumulativeCount}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, description: str, labelNames: Sequence[str] = (),
+                fn: Optional[Callable[[], float]] = None) -> Counter:
+        return self._register(Counter(name, description, labelNames, fn))
+
+    def gauge(self, name: str, description: str, fn: Optional[Callable[[], Optional[float]]] = None) -> Gauge:
+        return self._register(Gauge(name, description, fn))
+
+    def histogram(self, name: str, description: str, labelNames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, labelNames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
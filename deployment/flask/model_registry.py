@@ -0,0 +1,209 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from sensai.vector_model import VectorModel
+
+_log = logging.getLogger(__name__)
+
+
+def computeChecksum(path: str, chunkSize: int = 1 << 20) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Process-wide holder of the served model. The model is loaded once (at startup or on first access) and the same
+    instance is handed out to all requests and threads. When the artifact changes, a new version can be loaded
+    via reloadIfChanged and is swapped in atomically; requests holding a reference to the old model finish with it.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, modelPath: str, loader: Callable[[str], VectorModel],
+                 warmUp: Optional[Callable[[VectorModel], None]] = None,
+                 reloadWarmUp: Optional[Callable[[VectorModel], None]] = None):
+        """
+        :param modelPath: path of the model artifact
+        :param loader: function which loads the model from the given path
+        :param warmUp: function which is applied to a freshly loaded model before it is handed out
+        :param reloadWarmUp: function which is applied to a new version loaded by reloadIfChanged before it is swapped
+            in; if None, warmUp is applied
+        """
+        self.modelPath = modelPath
+        self._loader = loader
+        self._warmUp = warmUp
+        self._reloadWarmUp = reloadWarmUp if reloadWarmUp is not None else warmUp
+        self._lock = threading.Lock()
+        self._reloadLock = threading.Lock()
+        self._model: Optional[VectorModel] = None
+        self.version: Optional[str] = None
+        self.loadTimeSecs: Optional[float] = None
+        self.loadedAt: Optional[float] = None
+        self._artifactMtime: Optional[float] = None
+        self._backgroundLoadThread: Optional[threading.Thread] = None
+        self.loadFailedAt: Optional[float] = None
+
+    def isLoaded(self) -> bool:
+        """
+        :return: whether a model has been loaded (and warmed up), i.e. whether requests can be served without delay
+        """
+        return self._model is not None
+
+    def loadInBackground(self, retryIntervalSecs: float = 0):
+        """
+        Starts loading the model in a background thread unless it is already loaded or being loaded
+
+        :param retryIntervalSecs: the minimum time after a failed load (via tryLoad or in the background) before
+            loading is attempted again
+        """
+        with self._lock:
+            if self._model is not None or (self._backgroundLoadThread is not None and self._backgroundLoadThread.is_alive()):
+                return
+            if self.loadFailedAt is not None and time.monotonic() - self.loadFailedAt < retryIntervalSecs:
+                return
+            self._backgroundLoadThread = threading.Thread(target=self.tryLoad, name="ModelLoader", daemon=True)
+            self._backgroundLoadThread.start()
+
+    def tryLoad(self) -> bool:
+        """
+        Loads the model like load but logs failures instead of raising them (e.g. for optional models)
+
+        :return: whether the model is loaded
+        """
+        try:
+            self.load()
+            return True
+        except Exception:
+            self.loadFailedAt = time.monotonic()
+            self._log.exception(f"Failed to load model from {self.modelPath}")
+            return False
+
+    def _loadVersion(self, warmUp: Optional[Callable[[VectorModel], None]]):
+        mtime = os.path.getmtime(self.modelPath)
+        version = computeChecksum(self.modelPath)
+        self._log.info(f"Loading model version {version[:12]} from {self.modelPath}")
+        start = time.perf_counter()
+        model = self._loader(self.modelPath)
+        loadTimeSecs = time.perf_counter() - start
+        self._log.info(f"Loaded {model.__class__.__name__} version {version[:12]} in {loadTimeSecs:.3f}s")
+        if warmUp is not None:
+            start = time.perf_counter()
+            warmUp(model)
+            self._log.info(f"Warmed up model version {version[:12]} in {time.perf_counter() - start:.3f}s")
+        return model, version, mtime, loadTimeSecs
+
+    def _swap(self, model: VectorModel, version: str, mtime: float, loadTimeSecs: float):
+        with self._lock:
+            self._model = model
+            self.version = version
+            self._artifactMtime = mtime
+            self.loadTimeSecs = loadTimeSecs
+            self.loadedAt = time.time()
+
+    def load(self) -> VectorModel:
+        """
+        Loads the model unless it has already been loaded; concurrent callers wait for the pending load
+
+        :return: the loaded model
+        """
+        with self._reloadLock:
+            if self._model is None:
+                self._swap(*self._loadVersion(self._warmUp))
+            return self._model
+
+    def getModel(self) -> VectorModel:
+        model = self._model
+        if model is None:
+            model = self.load()
+        return model
+
+    def reloadIfChanged(self) -> bool:
+        """
+        Checks the artifact's modification time and checksum and, if the artifact has changed, loads and warms up the
+        new version in the calling thread before swapping it in. The old model keeps being served in the meantime
+        and if loading fails.
+        Artifacts should be replaced atomically (e.g. written to a temporary file and renamed); a partially written
+        file fails to load and is retried once its modification time changes again.
+
+        :return: whether a new version was swapped in
+        """
+        if self._model is None:
+            return False
+        with self._reloadLock:
+            try:
+                mtime = os.path.getmtime(self.modelPath)
+            except OSError as e:
+                self._log.warning(f"Cannot access model artifact {self.modelPath}: {e}")
+                return False
+            if mtime == self._artifactMtime:
+                return False
+            try:
+                if computeChecksum(self.modelPath) == self.version:
+                    self._artifactMtime = mtime
+                    return False
+                self._swap(*self._loadVersion(self._reloadWarmUp))
+            except Exception:
+                self._log.exception(f"Failed to reload model from {self.modelPath}; keeping version {self.version[:12]}")
+                self._artifactMtime = mtime
+                return False
+        self._log.info(f"Swapped in model version {self.version[:12]}")
+        return True
+
+    def getInfo(self) -> dict:
+        model = self._model
+        return {
+            "modelPath": self.modelPath,
+            "modelClass": model.__class__.__name__ if model is not None else None,
+            "version": self.version,
+            "loadTimeSecs": self.loadTimeSecs,
+            "loadedAt": self.loadedAt,
+        }
+
+
+class ModelArtifactWatcher:
+    """
+    Background thread which periodically checks a registry's model artifact for changes and hot-reloads it.
+    The thread is started lazily (and restarted in forked child processes) via ensureStarted unless the watcher was
+    disabled because another process (e.g. the master of a prefork server) performs the reloads.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, registry: ModelRegistry, intervalSecs: float):
+        self.registry = registry
+        self.intervalSecs = intervalSecs
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._startLock = threading.Lock()
+        self._disabled = False
+
+    def disable(self):
+        """
+        Prevents the thread from being started in this process and in processes forked from it
+        """
+        self._disabled = True
+
+    def ensureStarted(self):
+        if self._disabled or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._startLock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="ModelArtifactWatcher", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+            self._log.info(f"Watching {self.registry.modelPath} for changes every {self.intervalSecs}s")
+
+    def _run(self):
+        while True:
+            time.sleep(self.intervalSecs)
+            try:
+                self.registry.reloadIfChanged()
+            except Exception:
+                self._log.exception("Unexpected error while checking model artifact")
@@ -0,0 +1,138 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sensai.vector_model import VectorModel
+
+from model_registry import ModelRegistry
+
+_log = logging.getLogger(__name__)
+
+LATEST_VERSION = "latest"
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+class ModelNotFound(LookupError):
+    pass
+
+
+def _versionSortKey(version: str):
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"(\d+)", version) if part]
+
+
+class ModelStore:
+    """
+    Serves several models (and versions thereof) from a directory with the layout <modelDir>/<name>/<version>/<file>,
+    where <file> is the single artifact with the store's extension (e.g. .pickle or, for TorchScript, .pt).
+    Models are loaded on first use and kept resident as long as the sum of their artifact sizes (which approximates
+    their memory footprint) stays within the memory budget; beyond that, the least recently used models are evicted.
+    Requests holding a reference to an evicted model finish with it.
+    Each resident model is held in its own ModelRegistry, so loading and warm-up work like for the default model.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, modelDir: str, loader: Callable[[str], VectorModel], maxBytes: int,
+                 warmUp: Optional[Callable[[VectorModel], None]] = None, artifactExtension: str = ".pickle"):
+        """
+        :param modelDir: the root directory of the model artifacts
+        :param loader: function which loads a model from the given path
+        :param maxBytes: the memory budget in terms of artifact sizes; the most recently used model is always kept
+        :param warmUp: function which is applied to freshly loaded models
+        :param artifactExtension: the file extension of the artifacts which the loader accepts
+        """
+        self.modelDir = modelDir
+        self.maxBytes = maxBytes
+        self._loader = loader
+        self._warmUp = warmUp
+        self.artifactExtension = artifactExtension
+        self._registries: "OrderedDict[Tuple[str, str], ModelRegistry]" = OrderedDict()
+        self._sizes: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _findArtifact(self, name: str, version: str) -> str:
+        if not _NAME_PATTERN.match(name) or not _NAME_PATTERN.match(version):
+            raise ModelNotFound(f"Invalid model name or version: {name}/{version}")
+        versionDir = os.path.join(self.modelDir, name, version)
+        artifacts = sorted(f for f in os.listdir(versionDir) if f.endswith(self.artifactExtension)) \
+            if os.path.isdir(versionDir) else []
+        if len(artifacts) != 1:
+            raise ModelNotFound(f"Expected exactly one {self.artifactExtension} artifact in {versionDir}, "
+                                f"found {len(artifacts)}")
+        return os.path.join(versionDir, artifacts[0])
+
+    def listVersions(self, name: str) -> List[str]:
+        modelDir = os.path.join(self.modelDir, name)
+        if not _NAME_PATTERN.match(name) or not os.path.isdir(modelDir):
+            return []
+        return sorted((v for v in os.listdir(modelDir) if os.path.isdir(os.path.join(modelDir, v))), key=_versionSortKey)
+
+    def listModels(self) -> Dict[str, List[str]]:
+        """
+        :return: a mapping from model names to their available versions (in ascending order)
+        """
+        if not os.path.isdir(self.modelDir):
+            return {}
+        names = sorted(n for n in os.listdir(self.modelDir) if os.path.isdir(os.path.join(self.modelDir, n)))
+        return {name: self.listVersions(name) for name in names}
+
+    def resolveVersion(self, name: str, version: str) -> str:
+        """
+        :return: the given version or, for LATEST_VERSION, the highest available version
+        """
+        if version != LATEST_VERSION:
+            return version
+        versions = self.listVersions(name)
+        if not versions:
+            raise ModelNotFound(f"No versions of model {name} in {self.modelDir}")
+        return versions[-1]
+
+    def getRegistry(self, name: str, version: str) -> ModelRegistry:
+        """
+        :param name: the model name
+        :param version: the model version or LATEST_VERSION
+        :return: the (possibly not yet loaded) registry holding the model, which is marked as most recently used
+        :raises ModelNotFound: if there is no artifact for the given name and version
+        """
+        key = (name, self.resolveVersion(name, version))
+        with self._lock:
+            registry = self._registries.get(key)
+            if registry is not None:
+                self._registries.move_to_end(key)
+                return registry
+        path = self._findArtifact(*key)
+        with self._lock:
+            registry = self._registries.get(key)
+            if registry is None:
+                registry = ModelRegistry(path, self._loader, warmUp=self._warmUp)
+                self._registries[key] = registry
+                self._sizes[key] = os.path.getsize(path)
+                self._evict()
+            self._registries.move_to_end(key)
+            return registry
+
+    def numResident(self) -> int:
+        return len(self._registries)
+
+    def _evict(self):
+        while len(self._registries) > 1 and sum(self._sizes.values()) > self.maxBytes:
+            key, registry = self._registries.popitem(last=False)
+            del self._sizes[key]
+            self.evictions += 1
+            self._log.info(f"Evicted model {key[0]}/{key[1]} (version {registry.version}) to stay within memory budget")
+
+    def getInfo(self) -> dict:
+        with self._lock:
+            resident = [dict(registry.getInfo(), name=key[0], modelVersion=key[1], sizeBytes=self._sizes[key])
+                        for key, registry in self._registries.items()]
+        return {
+            "modelDir": self.modelDir,
+            "maxBytes": self.maxBytes,
+            "residentBytes": sum(r["sizeBytes"] for r in resident),
+            "evictions": self.evictions,
+            "resident": resident,
+            "available": self.listModels(),
+        }
@@ -0,0 +1,189 @@
+"""
+Binary and plain JSON payload formats for exchanging data frames with the prediction service
+"""
+import json
+import logging
+from json.decoder import JSONDecodeError
+from typing import Iterable, Iterator
+
+import jsonpickle
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_log = logging.getLogger(__name__)
+
+ARROW_STREAM_MIMETYPE = "application/vnd.apache.arrow.stream"
+COLUMNAR_JSON_MIMETYPE = "application/vnd.dataframe+json"
+NDJSON_MIMETYPE = "application/x-ndjson"
+NDJSON_INDEX_KEY = "_index"
+# column holding precomputed sentence embeddings (one vector per row), given as "embeddings" in columnar JSON
+EMBEDDINGS_COLUMN = "_embeddings"
+EMBEDDINGS_KEY = "embeddings"
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def decodeJsonPickle(encoded: str) -> pd.DataFrame:
+    """
+    Decodes a jsonpickle-encoded data frame (the format of the data field in application/json requests)
+    """
+    try:
+        x = jsonpickle.decode(encoded)  # expects a numpy array with dimensions (h, w, n_channels)
+    except JSONDecodeError:
+        raise PayloadError("The input string could not be decoded")
+    if not isinstance(x, pd.DataFrame):
+        raise PayloadError("The input has to be a numpy array. Instead got {}".format(x.__class__))
+    return x
+
+
+def isArrowSupported() -> bool:
+    return pa is not None
+
+
+def decodeArrowStream(body: bytes) -> pd.DataFrame:
+    """
+    Decodes an Arrow IPC stream into a data frame. The request buffer is wrapped without copying and numeric
+    columns without nulls are handed to pandas without copying where Arrow permits it.
+    The index is restored from the pandas metadata if the stream was written from a data frame.
+
+    :param body: the raw stream
+    :return: the decoded data frame
+    """
+    try:
+        table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    except pa.ArrowException as e:
+        raise PayloadError(f"The input could not be decoded as an Arrow IPC stream: {e}")
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def encodeArrowStream(df: pd.DataFrame) -> bytes:
+    """
+    Encodes a data frame (including its index) as an Arrow IPC stream
+    """
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    writer = pa.ipc.new_stream(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+def loadsJson(body: bytes):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def dumpsJson(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def decodeColumnarJson(body: bytes) -> pd.DataFrame:
+    """
+    Decodes a data frame from the columnar JSON format
+
+        {"columns": [<column name>, ...], "index": [<row label>, ...], "data": [[<value>, ...], ...],
+         "embeddings": [[<float>, ...], ...]}
+
+    where data contains one list of values per row, ordered as in columns. The index is optional and
+    defaults to a range index. The optional embeddings contain one precomputed sentence embedding per row, which is
+    added as column EMBEDDINGS_COLUMN (with float32 vectors). Only plain JSON values are accepted, no objects are
+    constructed.
+
+    :param body: the raw request body
+    :return: the decoded data frame
+    """
+    try:
+        content = loadsJson(body)
+    except ValueError as e:
+        raise PayloadError(f"The input could not be parsed as JSON: {e}")
+    if not isinstance(content, dict):
+        raise PayloadError("The input has to be a JSON object with keys 'columns', 'data' and optionally 'index'")
+    columns = content.get("columns")
+    data = content.get("data")
+    index = content.get("index")
+    if not isinstance(columns, list) or not isinstance(data, list):
+        raise PayloadError("The input requires the lists 'columns' and 'data'")
+    for row in data:
+        if not isinstance(row, list) or len(row) != len(columns):
+            raise PayloadError(f"Each row in 'data' has to be a list with {len(columns)} values")
+    if index is not None and (not isinstance(index, list) or len(index) != len(data)):
+        raise PayloadError(f"'index' has to be a list with {len(data)} entries")
+    df = pd.DataFrame(data, columns=columns, index=index)
+    embeddings = content.get(EMBEDDINGS_KEY)
+    if embeddings is not None:
+        if not isinstance(embeddings, list) or len(embeddings) != len(data):
+            raise PayloadError(f"'{EMBEDDINGS_KEY}' has to be a list with {len(data)} vectors")
+        try:
+            matrix = np.array(embeddings, dtype=np.float32)
+        except (TypeError, ValueError):
+            raise PayloadError(f"'{EMBEDDINGS_KEY}' has to contain lists of numbers of equal length")
+        if matrix.ndim != 2:
+            raise PayloadError(f"'{EMBEDDINGS_KEY}' has to contain lists of numbers of equal length")
+        df[EMBEDDINGS_COLUMN] = list(matrix)
+    return df
+
+
+def encodeColumnarJson(df: pd.DataFrame) -> bytes:
+    """
+    Encodes a data frame in the columnar JSON format (see decodeColumnarJson)
+    """
+    return dumpsJson({"columns": df.columns.tolist(), "index": df.index.tolist(), "data": df.values.tolist()})
+
+
+def iterNdjsonBatches(lines: Iterable[bytes], batchRows: int) -> Iterator[pd.DataFrame]:
+    """
+    Lazily parses newline-delimited JSON records into data frames of at most batchRows rows, such that only a single
+    batch is held in memory at a time. Each record is a JSON object mapping column names to values; the optional
+    key NDJSON_INDEX_KEY holds the row label, which defaults to the record's position in the stream.
+
+    :param lines: the lines of the stream
+    :param batchRows: the maximum number of rows per data frame
+    :return: a generator of data frames
+    """
+    records = []
+    index = []
+    numRecords = 0
+    for lineNumber, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = loadsJson(line)
+        except ValueError as e:
+            raise PayloadError(f"Line {lineNumber} could not be parsed as JSON: {e}")
+        if not isinstance(record, dict):
+            raise PayloadError(f"Line {lineNumber} has to be a JSON object")
+        index.append(record.pop(NDJSON_INDEX_KEY, numRecords))
+        records.append(record)
+        numRecords += 1
+        if len(records) == batchRows:
+            yield pd.DataFrame.from_records(records, index=index)
+            records = []
+            index = []
+    if records:
+        yield pd.DataFrame.from_records(records, index=index)
+
+
+def encodeNdjson(df: pd.DataFrame) -> bytes:
+    """
+    Encodes the rows of a data frame as newline-delimited JSON records (see iterNdjsonBatches)
+    """
+    columns = df.columns.tolist()
+    lines = [dumpsJson({NDJSON_INDEX_KEY: label, **dict(zip(columns, values))})
+             for label, values in zip(df.index.tolist(), df.values.tolist())]
+    return b"\n".join(lines) + b"\n"
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+_log = logging.getLogger(__name__)
+
+
+def _hashColumn(series: pd.Series) -> np.ndarray:
+    if series.dtype == object and len(series) > 0 and isinstance(series.iloc[0], (list, tuple, np.ndarray)):
+        # pandas would hash the (abbreviated) string representation of array-valued cells
+        return np.array([int.from_bytes(hashlib.blake2b(np.asarray(v).tobytes(), digest_size=8).digest(), "little")
+                         for v in series], dtype=np.uint64)
+    return pd.util.hash_pandas_object(series, index=False).values
+
+
+def computeRowHashes(df: pd.DataFrame) -> List[bytes]:
+    """
+    Computes a stable content hash for each row of the given data frame, which does not depend on the row's label
+
+    :param df: the data frame
+    :return: a list with one hash per row
+    """
+    if len(df.columns) == 0:
+        return [b""] * len(df)
+    hashes = np.ascontiguousarray(np.column_stack([_hashColumn(df[col]) for col in df.columns]))
+    return [row.tobytes() for row in hashes]
+
+
+class PredictionCache:
+    """
+    In-process LRU cache of predicted rows with a time to live, keyed by the content of the input row, the input's
+    columns and the model version. Only rows which are not found in the cache are passed on to the model.
+    """
+    _log = _log.getChild(__qualname__)
+
+    _ENTRY_OVERHEAD_BYTES = 200
+
+    def __init__(self, maxEntries: int, ttlSecs: float, maxBytes: int):
+        """
+        :param maxEntries: the maximum number of cached rows
+        :param ttlSecs: the time after which a cached row expires
+        :param maxBytes: the (approximate) maximum memory occupied by cached rows
+        """
+        self.maxEntries = maxEntries
+        self.ttlSecs = ttlSecs
+        self.maxBytes = maxBytes
+        self._entries: "OrderedDict[Hashable, Tuple[float, tuple, tuple, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.numBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def _estimateSize(cls, values: tuple) -> int:
+        return cls._ENTRY_OVERHEAD_BYTES + sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.maxEntries or self.numBytes > self.maxBytes):
+            _, (_, _, _, size) = self._entries.popitem(last=False)
+            self.numBytes -= size
+            self.evictions += 1
+
+    def predict(self, x: pd.DataFrame, predictFn: Callable[[pd.DataFrame], pd.DataFrame], modelVersion: str) -> pd.DataFrame:
+        """
+        :param x: the input data frame
+        :param predictFn: the function with which to predict rows not found in the cache
+        :param modelVersion: the version of the model applied by predictFn
+        :return: the predictions for all rows of x in the order of x and with x's index
+        """
+        inputColumns = tuple(x.columns)
+        keys = [(modelVersion, inputColumns, rowHash) for rowHash in computeRowHashes(x)]
+        cachedRows = [None] * len(keys)
+        missPositions = []
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] < now:
+                    del self._entries[key]
+                    self.numBytes -= entry[3]
+                    entry = None
+                if entry is None:
+                    missPositions.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    cachedRows[i] = entry
+            self.hits += len(keys) - len(missPositions)
+            self.misses += len(missPositions)
+
+        if len(missPositions) == len(keys):
+            y = predictFn(x)
+            self._store(keys, y)
+            return y
+
+        yMissing = None
+        if missPositions:
+            yMissing = predictFn(x.iloc[missPositions])
+            self._store([keys[i] for i in missPositions], yMissing)
+            for i, values in zip(missPositions, yMissing.itertuples(index=False, name=None)):
+                cachedRows[i] = (None, tuple(yMissing.columns), values, None)
+        outputColumns = cachedRows[0][1]
+        y = pd.DataFrame([entry[2] for entry in cachedRows], columns=list(outputColumns), index=x.index)
+        if yMissing is not None:
+            y = y.astype(yMissing.dtypes.to_dict())
+        return y
+
+    def _store(self, keys: List[Hashable], y: pd.DataFrame):
+        outputColumns = tuple(y.columns)
+        expiry = time.monotonic() + self.ttlSecs
+        with self._lock:
+            for key, values in zip(keys, y.itertuples(index=False, name=None)):
+                size = self._estimateSize(values)
+                previous = self._entries.pop(key, None)
+                if previous is not None:
+                    self.numBytes -= previous[3]
+                self._entries[key] = (expiry, outputColumns, values, size)
+                self.numBytes += size
+            self._evict()
+
+    def getStats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.numBytes,
+                "maxEntries": self.maxEntries,
+                "maxBytes": self.maxBytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
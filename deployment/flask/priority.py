@@ -0,0 +1,112 @@
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional, Sequence
+
+from deadlines import Deadline, DeadlineExceeded
+
+_log = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+
+def priorityRank(priorityClass: str) -> int:
+    """
+    :param priorityClass: one of PRIORITY_CLASSES
+    :return: the rank of the class, where lower ranks are served first
+    """
+    return PRIORITY_CLASSES.index(priorityClass)
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class PriorityGate:
+    """
+    Limits the number of concurrent predictions, both in total and per priority class. Callers which exceed a limit
+    wait in a FIFO queue per class; when a slot is freed, it is granted to the first waiter of the highest-priority
+    class whose budget allows it. Thus bulk work can use idle capacity but cannot delay interactive requests by more
+    than the duration of the predictions already running, and bulk work cannot take more than its own budget.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, maxConcurrency: int, budgets: Dict[str, int], classes: Sequence[str] = PRIORITY_CLASSES):
+        """
+        :param maxConcurrency: the maximum number of predictions running concurrently across all classes
+        :param budgets: the maximum number of predictions running concurrently per class; classes without an entry
+            may use the full concurrency
+        :param classes: the priority classes, highest priority first
+        """
+        self.maxConcurrency = max(1, maxConcurrency)
+        self.classes = tuple(classes)
+        self.budgets = {c: max(1, min(budgets.get(c, self.maxConcurrency), self.maxConcurrency)) for c in self.classes}
+        self.inFlight: Dict[str, int] = {c: 0 for c in self.classes}
+        self._waiters: Dict[str, Deque[_Waiter]] = {c: deque() for c in self.classes}
+        self._lock = threading.Lock()
+
+    def numWaiting(self, priorityClass: str) -> int:
+        return len(self._waiters[priorityClass])
+
+    def _totalInFlight(self) -> int:
+        return sum(self.inFlight.values())
+
+    def _hasCapacity(self, priorityClass: str) -> bool:
+        return self._totalInFlight() < self.maxConcurrency and self.inFlight[priorityClass] < self.budgets[priorityClass]
+
+    def _hasPrecedingWaiters(self, priorityClass: str) -> bool:
+        for c in self.classes[:self.classes.index(priorityClass) + 1]:
+            if self._waiters[c] and self.inFlight[c] < self.budgets[c]:
+                return True
+        return False
+
+    def acquire(self, priorityClass: str, deadline: Optional[Deadline] = None):
+        """
+        Waits until a slot for the given class is available. Every successful call must be followed by a call to
+        release with the same class.
+
+        :param priorityClass: the priority class of the caller
+        :param deadline: the deadline after which waiting is abandoned
+        :raises DeadlineExceeded: if the deadline passes before a slot is granted
+        """
+        with self._lock:
+            if self._hasCapacity(priorityClass) and not self._hasPrecedingWaiters(priorityClass):
+                self.inFlight[priorityClass] += 1
+                return
+            waiter = _Waiter()
+            self._waiters[priorityClass].append(waiter)
+        granted = waiter.event.wait(max(0.0, deadline.remainingSecs()) if deadline is not None else None)
+        if not granted:
+            with self._lock:
+                if not waiter.granted:
+                    self._waiters[priorityClass].remove(waiter)
+                    raise DeadlineExceeded(f"Deadline exceeded while waiting for a {priorityClass} prediction slot")
+
+    def release(self, priorityClass: str):
+        with self._lock:
+            self.inFlight[priorityClass] -= 1
+            self._grant()
+
+    def _grant(self):
+        for c in self.classes:
+            waiters = self._waiters[c]
+            while waiters and self._hasCapacity(c):
+                waiter = waiters.popleft()
+                waiter.granted = True
+                self.inFlight[c] += 1
+                waiter.event.set()
+            if self._totalInFlight() >= self.maxConcurrency:
+                return
+
+    @contextmanager
+    def slot(self, priorityClass: str, deadline: Optional[Deadline] = None):
+        self.acquire(priorityClass, deadline)
+        try:
+            yield
+        finally:
+            self.release(priorityClass)
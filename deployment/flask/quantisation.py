@@ -0,0 +1,35 @@
+import io
+import logging
+import pickle
+
+import torch
+from sensai.torch.torch_base import TorchVectorClassificationModel
+
+_log = logging.getLogger(__name__)
+
+QUANTISATION_INT8 = "int8"
+
+
+def quantiseModel(model: TorchVectorClassificationModel) -> TorchVectorClassificationModel:
+    """
+    Creates a copy of the given model in which the linear layers of the torch module (the MLP) are dynamically
+    quantised to int8: weights are stored as int8 and activations are quantised on the fly, which makes CPU inference
+    cheaper at a small loss of precision. Feature generation (BERT encoding) and normalisation are not affected.
+    The copy can be pickled and served like the original model.
+
+    :param model: a torch classification model (e.g. MultiLayerPerceptronVectorClassificationModel) applied on the CPU
+    :return: the quantised copy
+    """
+    if not isinstance(model, TorchVectorClassificationModel):
+        raise ValueError(f"Quantisation is only supported for torch classification models, got {model.__class__.__name__}")
+    if model.model.cuda:
+        raise ValueError("Quantised models can only be applied on the CPU")
+    buffer = io.BytesIO()
+    pickle.dump(model, buffer)
+    buffer.seek(0)
+    quantised = pickle.load(buffer)
+    module = quantised.model.module
+    module.eval()
+    quantised.model.module = torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+    _log.info(f"Quantised linear layers of {model.__class__.__name__} to int8")
+    return quantised
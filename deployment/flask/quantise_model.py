@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Converts a pickled review classifier (as produced by preprocessing/emr/cleaning_spark.py) into a dynamically quantised
+(int8) variant and reports accuracy and latency of both variants on a held-out split.
+
+The held-out data is a CSV or Parquet file with an identifier column (used as index), the model's input columns
+(e.g. reviewText) and the target column. Features are generated once and shared by both variants, since quantisation
+only affects the MLP; latencies are reported for the MLP on its own and for a complete prediction.
+
+    python quantise_model.py reviewClassifier-v1.pickle reviewClassifier-v1-int8.pickle --data heldout.parquet
+"""
+import argparse
+import json
+import logging
+import pickle
+import statistics
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from quantisation import quantiseModel
+
+_log = logging.getLogger(__name__)
+
+
+def readHeldOutData(path: str, indexColumn: str, testFraction: float, seed: int) -> pd.DataFrame:
+    df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    df = df.set_index(indexColumn, drop=True).dropna()
+    if testFraction < 1:
+        df = df.sample(frac=testFraction, random_state=seed)
+    return df
+
+
+def timeMsPerRow(fn: Callable, numRows: int, repetitions: int) -> float:
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000 / numRows
+
+
+def createReport(model, quantisedModel, data: pd.DataFrame, targetColumn: str, repetitions: int) -> dict:
+    x = data.drop(columns=[targetColumn])
+    yTrue = data[targetColumn].values
+    inputs = model._computeInputs(x)
+    report = {"numRows": len(x)}
+    predictions = {}
+    for name, m in (("float32", model), ("int8", quantisedModel)):
+        y = m._predict(inputs).iloc[:, 0].values
+        predictions[name] = y
+        report[name] = {
+            "accuracy": float(np.mean(y == yTrue)),
+            "mlpMsPerRow": timeMsPerRow(lambda: m._predict(inputs), len(x), repetitions),
+            "predictMsPerRow": timeMsPerRow(lambda: m.predict(x), len(x), max(1, repetitions // 5)),
+            "artifactBytes": len(pickle.dumps(m)),
+        }
+    report["agreement"] = float(np.mean(predictions["float32"] == predictions["int8"]))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help="path of the pickled model")
+    parser.add_argument("output", help="path to which the quantised model is pickled")
+    parser.add_argument("--data", help="held-out data for the accuracy and latency report", default=None)
+    parser.add_argument("--index-column", default="identifier")
+    parser.add_argument("--target-column", default="overall")
+    parser.add_argument("--test-fraction", type=float, default=1.0,
+                        help="fraction of the rows in --data to evaluate on (sampled with --seed)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument("--report", help="path to which the report is written as JSON", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.model, 'rb') as f:
+        model = pickle.load(f)
+    quantisedModel = quantiseModel(model)
+    with open(args.output, 'wb') as f:
+        pickle.dump(quantisedModel, f)
+    _log.info(f"Wrote quantised model to {args.output}")
+
+    if args.data is not None:
+        data = readHeldOutData(args.data, args.index_column, args.test_fraction, args.seed)
+        report = createReport(model, quantisedModel, data, args.target_column, args.repetitions)
+        print(f"{'variant':<8} {'accuracy':>9} {'MLP ms/row':>11} {'predict ms/row':>15} {'artifact bytes':>15}")
+        for name in ("float32", "int8"):
+            r = report[name]
+            print(f"{name:<8} {r['accuracy']:>9.4f} {r['mlpMsPerRow']:>11.4f} {r['predictMsPerRow']:>15.3f} "
+                  f"{r['artifactBytes']:>15}")
+        print(f"Predictions agree on {report['agreement'] * 100:.2f}% of {report['numRows']} rows")
+        if args.report is not None:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Scores a large input file offline with the model served by the service (loaded via app.loadModel, i.e. from
+MODEL_PATH with the same backend and quantisation settings). The input (Parquet, JSONL or CSV) is read in chunks
+(Parquet row by row group), chunks are scored by a pool of worker processes and the predictions are written in input
+order as soon as they are available (CSV, JSONL, or a directory of Parquet parts if the output ends with .parquet).
+
+After every chunk, the progress is recorded next to the output (<output>.progress). An interrupted run continues
+after the last recorded chunk when started again with --resume and the same input and chunk size.
+
+    python score.py reviews.parquet predictions.jsonl --workers 4 --resume
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import time
+from collections import deque
+from typing import Iterator, Optional
+
+import pandas as pd
+from sensai.vector_model import VectorModel
+
+from app import MODEL_PATH, loadModel
+from inference import usePrecomputedEmbeddings
+from payload import encodeNdjson
+
+_log = logging.getLogger(__name__)
+
+_model = None
+
+
+def _initWorker(torchThreads: int):
+    if torchThreads > 0:
+        import torch
+        torch.set_num_threads(torchThreads)
+
+
+def _scoreChunk(x: pd.DataFrame) -> pd.DataFrame:
+    if isinstance(_model, VectorModel):
+        x = usePrecomputedEmbeddings(_model, x)
+    y = _model.predict(x)
+    y.index = x.index
+    return y
+
+
+def iterChunks(path: str, chunkRows: int, indexColumn: Optional[str], skipChunks: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    :param path: the input file (.parquet, .jsonl/.ndjson or .csv)
+    :param chunkRows: the maximum number of rows per chunk
+    :param indexColumn: the column to use as index (e.g. identifier); if None, rows are numbered
+    :param skipChunks: the number of leading chunks to skip
+    :return: an iterator of the chunks after the skipped ones
+    """
+    def withIndex(df: pd.DataFrame) -> pd.DataFrame:
+        return df.set_index(indexColumn, drop=True) if indexColumn is not None else df
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquetFile = pq.ParquetFile(path)
+        chunkIndex = 0
+        rowOffset = 0
+        for rowGroup in range(parquetFile.num_row_groups):
+            numRows = parquetFile.metadata.row_group(rowGroup).num_rows
+            numChunks = math.ceil(numRows / chunkRows)
+            if chunkIndex + numChunks <= skipChunks:
+                chunkIndex += numChunks
+                rowOffset += numRows
+                continue
+            df = parquetFile.read_row_group(rowGroup).to_pandas()
+            if indexColumn is None:
+                df.index = pd.RangeIndex(rowOffset, rowOffset + numRows)
+            for start in range(0, numRows, chunkRows):
+                if chunkIndex >= skipChunks:
+                    yield withIndex(df.iloc[start:start + chunkRows])
+                chunkIndex += 1
+            rowOffset += numRows
+        return
+    if path.endswith(".jsonl") or path.endswith(".ndjson"):
+        reader = pd.read_json(path, lines=True, chunksize=chunkRows)
+    elif path.endswith(".csv"):
+        reader = pd.read_csv(path, chunksize=chunkRows)
+    else:
+        raise ValueError(f"Unsupported input format: {path}")
+    for chunkIndex, df in enumerate(reader):
+        if chunkIndex >= skipChunks:
+            yield withIndex(df)
+
+
+class PredictionWriter:
+    """
+    Appends predictions to the output and reports the position after the last write, to which the output is
+    truncated when a run is resumed
+    """
+    def __init__(self, path: str, position: int):
+        self.path = path
+        self.isParquet = path.endswith(".parquet")
+        self.isCsv = path.endswith(".csv")
+        if not self.isParquet and not self.isCsv and not (path.endswith(".jsonl") or path.endswith(".ndjson")):
+            raise ValueError(f"Unsupported output format: {path}")
+        self.position = position
+        if self.isParquet:
+            os.makedirs(path, exist_ok=True)
+            for fileName in os.listdir(path):
+                if fileName.startswith("part-") and int(fileName[5:10]) >= position:
+                    os.remove(os.path.join(path, fileName))
+            self._file = None
+        else:
+            self._file = open(path, 'ab')
+            self._file.truncate(position)
+
+    def write(self, y: pd.DataFrame):
+        if self.isParquet:
+            y.to_parquet(os.path.join(self.path, f"part-{self.position:05d}.parquet"))
+            self.position += 1
+            return
+        if self.isCsv:
+            data = y.to_csv(header=self.position == 0).encode("utf-8")
+        else:
+            data = encodeNdjson(y)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.position = self._file.tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def readProgress(progressPath: str, inputPath: str, chunkRows: int) -> dict:
+    with open(progressPath, 'r') as f:
+        progress = json.load(f)
+    if progress["input"] != os.path.abspath(inputPath) or progress["chunkRows"] != chunkRows:
+        raise ValueError(f"{progressPath} belongs to a run with input {progress['input']} and chunk size "
+                         f"{progress['chunkRows']}")
+    return progress
+
+
+def writeProgress(progressPath: str, progress: dict):
+    tmpPath = progressPath + ".tmp"
+    with open(tmpPath, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmpPath, progressPath)
+
+
+def score(inputPath: str, outputPath: str, chunkRows: int, numWorkers: int, torchThreads: int,
+          indexColumn: Optional[str], resume: bool, reportIntervalSecs: float):
+    progressPath = outputPath + ".progress"
+    if resume and os.path.exists(progressPath):
+        progress = readProgress(progressPath, inputPath, chunkRows)
+        _log.info(f"Resuming after {progress['chunks']} chunks ({progress['rows']} rows)")
+    else:
+        if os.path.exists(outputPath) and not outputPath.endswith(".parquet"):
+            os.remove(outputPath)
+        progress = {"input": os.path.abspath(inputPath), "chunkRows": chunkRows, "chunks": 0, "rows": 0,
+                    "outputPosition": 0}
+
+    global _model
+    _model = loadModel(MODEL_PATH)  # loaded before forking, such that the workers share its memory
+    writer = PredictionWriter(outputPath, progress["outputPosition"])
+    chunks = iterChunks(inputPath, chunkRows, indexColumn, skipChunks=progress["chunks"])
+    start = lastReport = time.perf_counter()
+    rowsAtStart = rowsAtLastReport = progress["rows"]
+    with multiprocessing.get_context("fork").Pool(numWorkers, initializer=_initWorker, initargs=(torchThreads,)) as pool:
+        pending = deque()
+        exhausted = False
+        while not exhausted or pending:
+            # keep a bounded number of chunks in flight, such that the input is not read ahead without limit
+            while not exhausted and len(pending) < 2 * numWorkers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.append(pool.apply_async(_scoreChunk, (chunk,)))
+            if not pending:
+                break
+            y = pending.popleft().get()
+            writer.write(y)
+            progress["chunks"] += 1
+            progress["rows"] += len(y)
+            progress["outputPosition"] = writer.position
+            writeProgress(progressPath, progress)
+
+            now = time.perf_counter()
+            if now - lastReport >= reportIntervalSecs:
+                _log.info(f"Scored {progress['rows']} rows; {(progress['rows'] - rowsAtLastReport) / (now - lastReport):.1f} "
+                          f"rows/s recently, {(progress['rows'] - rowsAtStart) / (now - start):.1f} rows/s overall")
+                lastReport, rowsAtLastReport = now, progress["rows"]
+    writer.close()
+    durationSecs = time.perf_counter() - start
+    _log.info(f"Finished scoring {progress['rows']} rows in {progress['chunks']} chunks "
+              f"({(progress['rows'] - rowsAtStart) / max(durationSecs, 1e-9):.1f} rows/s in this run)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="input file (.parquet, .jsonl/.ndjson or .csv)")
+    parser.add_argument("output", help="output file (.csv or .jsonl/.ndjson) or directory of parts (.parquet)")
+    parser.add_argument("--chunk-rows", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--torch-threads", type=int, default=1,
+                        help="number of torch threads per worker process; 0 keeps torch's default")
+    parser.add_argument("--index-column", default="identifier",
+                        help="input column used as index of the predictions; empty to number the rows")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run from its progress file instead of starting over")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between throughput reports")
+    args = parser.parse_args()
+    # importing app configures logging with LOGLEVEL (WARNING by default), which would hide the progress reports
+    _log.setLevel(min(logging.INFO, logging.getLogger().getEffectiveLevel()))
+
+    score(args.input, args.output, args.chunk_rows, args.workers, args.torch_threads, args.index_column or None,
+          args.resume, args.report_interval)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the prediction service. The model is loaded once in a master process, which then forks
+worker processes serving requests on a shared listening socket. The workers share the model's memory pages
+(torch weights, BERT encoder) copy-on-write, so adding workers does not multiply the resident memory.
+With hot reloading enabled, the master checks the model artifact and, after loading a new version, replaces the workers
+by freshly forked ones, such that the new version is shared as well instead of being loaded by every worker.
+
+    python serve.py --workers 4 --torch-threads 2
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Dict, Optional, Set
+
+import torch
+from werkzeug.serving import make_server
+
+from app import app, checkFeatureTable, fallbackRegistry, modelRegistry, modelWatcher, shadowScorer, HOST, PORT
+from model_registry import ModelArtifactWatcher
+
+_log = logging.getLogger(__name__)
+
+
+class PreforkServer:
+    """
+    Forks a fixed number of workers which accept connections on a socket bound by the master and
+    replaces workers which exit unexpectedly. If a model watcher is given, the master hot-reloads the model and
+    replaces all workers after a new version was swapped in.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, host: str, port: int, numWorkers: int, torchThreads: int, threaded: bool,
+                 modelWatcher: Optional[ModelArtifactWatcher] = None):
+        """
+        :param host: the host to bind to
+        :param port: the port to bind to
+        :param numWorkers: the number of worker processes
+        :param torchThreads: the number of torch intra-op threads per worker
+        :param threaded: whether each worker handles requests in multiple threads (which is required for micro-batching
+            to collect concurrent requests within a worker)
+        :param modelWatcher: the watcher of the model artifact; it is disabled in the workers and its checks are
+            performed by the master instead
+        """
+        self.numWorkers = numWorkers
+        self.torchThreads = torchThreads
+        self.server = make_server(host or "0.0.0.0", port, app, threaded=threaded)
+        self.modelWatcher = modelWatcher
+        self._workers: Dict[int, int] = {}
+        self._retiring: Set[int] = set()
+        self._stopping = False
+
+    def _startWorker(self, workerId: int):
+        pid = os.fork()
+        if pid == 0:
+            exitCode = 0
+            try:
+                self._runWorker(workerId)
+            except BaseException:
+                self._log.exception(f"Worker {workerId} failed")
+                exitCode = 1
+            finally:
+                os._exit(exitCode)
+        self._workers[pid] = workerId
+
+    def _runWorker(self, workerId: int):
+        stopEvent = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopEvent.set())
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        torch.set_num_threads(self.torchThreads)
+        # request threads are joined when the server is closed, so a stopped worker finishes the requests it is handling
+        self.server.daemon_threads = False
+        self._log.info(f"Worker {workerId} (pid {os.getpid()}) serving with {self.torchThreads} torch threads")
+        serverThread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        serverThread.start()
+        while not stopEvent.wait(1):
+            if not serverThread.is_alive():
+                raise RuntimeError("Server thread terminated")
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for pid in self._workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    @staticmethod
+    def _freezeHeap():
+        # keep the objects created so far (in particular the model) out of garbage collection, which would
+        # otherwise touch and thereby copy their pages in every worker
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    def _replaceWorkers(self):
+        """
+        Forks a new worker for each running one and then stops the old workers, which finish the requests they are
+        handling, such that the socket is served throughout
+        """
+        self._freezeHeap()
+        oldWorkers = dict(self._workers)
+        for workerId in oldWorkers.values():
+            self._startWorker(workerId)
+        for pid, workerId in oldWorkers.items():
+            self._retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self._log.info(f"Replaced {len(oldWorkers)} workers after reloading the model")
+
+    def _reloadModelIfChanged(self):
+        try:
+            if self.modelWatcher.registry.reloadIfChanged() and not self._stopping:
+                self._replaceWorkers()
+        except Exception:
+            self._log.exception("Unexpected error while checking model artifact")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if self.modelWatcher is not None:
+            self.modelWatcher.disable()
+        self._freezeHeap()
+        for workerId in range(self.numWorkers):
+            self._startWorker(workerId)
+        self._log.info(f"Started {self.numWorkers} workers on {self.server.server_address}")
+        nextReloadCheck = time.monotonic() + self.modelWatcher.intervalSecs if self.modelWatcher is not None else None
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            if pid == 0:
+                if nextReloadCheck is not None and time.monotonic() >= nextReloadCheck and not self._stopping:
+                    self._reloadModelIfChanged()
+                    nextReloadCheck = time.monotonic() + self.modelWatcher.intervalSecs
+                else:
+                    time.sleep(0.2)
+                continue
+            workerId = self._workers.pop(pid, None)
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+            elif workerId is not None and not self._stopping:
+                self._log.warning(f"Worker {workerId} (pid {pid}) exited with status {status}; restarting it")
+                time.sleep(1)
+                self._startWorker(workerId)
+        self.server.server_close()
+        self._log.info("All workers stopped")
+
+
+if __name__ == '__main__':
+    cpuCount = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('WORKERS', cpuCount)),
+                        help="number of worker processes (env WORKERS, default: number of CPUs)")
+    parser.add_argument("--torch-threads", type=int, default=os.environ.get('TORCH_THREADS'),
+                        help="torch intra-op threads per worker (env TORCH_THREADS, default: CPUs divided by workers)")
+    parser.add_argument("--threaded", action="store_true", default=os.environ.get('WORKER_THREADED', '1') == '1',
+                        help="handle requests in multiple threads per worker (env WORKER_THREADED)")
+    parser.add_argument("--single-threaded", dest="threaded", action="store_false")
+    args = parser.parse_args()
+    torchThreads = int(args.torch_threads) if args.torch_threads is not None else max(1, cpuCount // args.workers)
+
+    modelRegistry.load()
+    checkFeatureTable()
+    # optional models are loaded before forking as well, such that the workers share them instead of each loading
+    # its own copy; if loading fails, they are loaded on first use as before
+    if shadowScorer is not None:
+        shadowScorer.registry.tryLoad()
+    if fallbackRegistry is not None:
+        fallbackRegistry.tryLoad()
+    server = PreforkServer(HOST, PORT, args.workers, torchThreads, args.threaded, modelWatcher=modelWatcher)
+    server.run()
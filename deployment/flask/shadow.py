@@ -0,0 +1,107 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+from sensai.vector_model import VectorModel
+
+from model_registry import ModelRegistry
+
+_log = logging.getLogger(__name__)
+
+
+class ShadowScorer:
+    """
+    Mirrors a fraction of the live requests to a candidate model in a bounded background thread pool and records its
+    latency and its agreement with the primary model's predictions. Mirroring never blocks the caller: if the pool
+    is busy with maxQueued requests, further requests are not mirrored. Unless it has been loaded at startup, the
+    candidate model is loaded by the first mirrored request in the background.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, registry: ModelRegistry, fraction: float, maxWorkers: int, maxQueued: int,
+                 onResult: Optional[Callable[[int, int, float, float], None]] = None):
+        """
+        :param registry: the registry holding the candidate model
+        :param fraction: the fraction of requests to mirror
+        :param maxWorkers: the number of threads applying the candidate model
+        :param maxQueued: the maximum number of mirrored requests being processed or waiting
+        :param onResult: callback which receives the number of rows, the number of rows on which the predictions agree,
+            the primary latency and the candidate latency (in seconds) of each mirrored request
+        """
+        self.registry = registry
+        self.fraction = fraction
+        self.maxWorkers = maxWorkers
+        self.maxQueued = maxQueued
+        self.onResult = onResult
+        self.mirrored = 0
+        self.dropped = 0
+        self.errors = 0
+        self._numPending = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+
+    def _getExecutor(self) -> ThreadPoolExecutor:
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.maxWorkers, thread_name_prefix="ShadowScorer")
+            self._pid = os.getpid()
+            self._numPending = 0
+        return self._executor
+
+    def maybeMirror(self, x: pd.DataFrame, primaryPrediction: pd.DataFrame, primaryLatencySecs: float):
+        """
+        Mirrors the request to the candidate model with probability fraction. The data frames must not be modified
+        afterwards.
+
+        :param x: the input data frame of the request
+        :param primaryPrediction: the primary model's predictions for x
+        :param primaryLatencySecs: the time the primary model took to predict x
+        """
+        if random.random() >= self.fraction:
+            return
+        with self._lock:
+            if self._numPending >= self.maxQueued:
+                self.dropped += 1
+                return
+            self._numPending += 1
+            executor = self._getExecutor()
+        executor.submit(self._score, x, primaryPrediction, primaryLatencySecs)
+
+    def _score(self, x: pd.DataFrame, primaryPrediction: pd.DataFrame, primaryLatencySecs: float):
+        try:
+            model: VectorModel = self.registry.getModel()
+            start = time.perf_counter()
+            y = model.predict(x)
+            latencySecs = time.perf_counter() - start
+            numAgreeing = int(np.sum(np.all(y.values == primaryPrediction.values, axis=1))) \
+                if y.shape == primaryPrediction.shape else 0
+            with self._lock:
+                self.mirrored += 1
+            if self.onResult is not None:
+                self.onResult(len(x), numAgreeing, primaryLatencySecs, latencySecs)
+            self._log.debug(f"Shadow prediction for {len(x)} rows took {latencySecs * 1000:.1f}ms "
+                            f"(primary {primaryLatencySecs * 1000:.1f}ms), {numAgreeing} rows agree")
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            self._log.exception("Shadow prediction failed")
+        finally:
+            with self._lock:
+                self._numPending -= 1
+
+    def getStats(self) -> dict:
+        return {
+            "modelPath": self.registry.modelPath,
+            "version": self.registry.version,
+            "fraction": self.fraction,
+            "mirrored": self.mirrored,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "pending": self._numPending,
+        }
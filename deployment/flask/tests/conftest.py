@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the service's modules are imported as top-level modules, as in the app itself
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
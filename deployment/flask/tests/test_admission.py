@@ -0,0 +1,59 @@
+import pytest
+
+from admission import AdaptiveConcurrencyLimiter, AdmissionRejected
+
+
+def _limiter(**kwargs) -> AdaptiveConcurrencyLimiter:
+    params = dict(initialLimit=4, minLimit=1, maxLimit=8, maxQueueWaitMs=0, maxQueued=0, targetLatencyMs=100)
+    params.update(kwargs)
+    return AdaptiveConcurrencyLimiter(**params)
+
+
+def _complete(limiter: AdaptiveConcurrencyLimiter, latencySecs: float, n: int = 1):
+    for _ in range(n):
+        limiter.acquire()
+        limiter.release(latencySecs)
+
+
+def test_limitIncreasesAdditivelyWhileLatenciesAreLow():
+    limiter = _limiter()
+    _complete(limiter, 0.01, 4)
+    assert limiter.limit == pytest.approx(5, abs=0.1)
+    _complete(limiter, 0.01, 100)
+    assert limiter.limit == 8
+
+
+def test_limitDecreasesMultiplicativelyOnHighLatency():
+    limiter = _limiter(initialLimit=8)
+    _complete(limiter, 0.5)
+    assert limiter.limit == pytest.approx(8 * 0.9)
+    # at most one decrease per observed latency
+    _complete(limiter, 0.5)
+    assert limiter.limit == pytest.approx(8 * 0.9)
+
+
+def test_thresholdFollowsBaselineWithoutTarget():
+    limiter = _limiter(initialLimit=8, targetLatencyMs=None, latencyTolerance=2.0)
+    _complete(limiter, 0.01, 10)
+    assert limiter.baselineLatencySecs == pytest.approx(0.01)
+    _complete(limiter, 0.05)
+    assert limiter.limit == pytest.approx(8 * 0.9)
+
+
+def test_requestsBeyondLimitAreRejected():
+    limiter = _limiter(initialLimit=1)
+    limiter.acquire()
+    with pytest.raises(AdmissionRejected):
+        limiter.acquire()
+    assert limiter.rejected == 1
+    limiter.release(0.01)
+    limiter.acquire()
+
+
+def test_releaseWithoutLatencyKeepsLimitAndBaseline():
+    limiter = _limiter(targetLatencyMs=None)
+    _complete(limiter, 0.05, 5)
+    limit, baseline = limiter.limit, limiter.baselineLatencySecs
+    limiter.acquire()
+    limiter.release(None)
+    assert (limiter.limit, limiter.baselineLatencySecs, limiter.inFlight) == (limit, baseline, 0)
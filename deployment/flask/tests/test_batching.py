@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from batching import MicroBatcher
+from deadlines import Deadline, DeadlineExceeded
+from priority import PRIORITY_BULK, PRIORITY_CLASSES, PriorityGate
+
+
+def _double(x: pd.DataFrame, onStage, deadline) -> pd.DataFrame:
+    return pd.DataFrame({"y": x["a"] * 2}, index=x.index)
+
+
+def test_batchRowsAreReturnedToTheirRequests():
+    batchSizes = []
+
+    def predict(x, onStage, deadline):
+        batchSizes.append(len(x))
+        return _double(x, onStage, deadline)
+
+    batcher = MicroBatcher(predict, maxRows=100, maxWaitMs=200)
+    inputs = [pd.DataFrame({"a": [i, i + 1]}, index=[10 * i, 10 * i + 1]) for i in range(3)]
+    futures = [batcher.submit(x) for x in inputs]
+    for x, future in zip(inputs, futures):
+        y = future.result(timeout=5)
+        assert list(y.index) == list(x.index)
+        assert list(y["y"]) == list(x["a"] * 2)
+    assert batchSizes == [6]
+
+
+def test_inputsWithDifferentColumnsArePredictedSeparately():
+    batchColumns = []
+
+    def predict(x, onStage, deadline):
+        batchColumns.append(tuple(x.columns))
+        return pd.DataFrame({"y": [0] * len(x)}, index=x.index)
+
+    batcher = MicroBatcher(predict, maxRows=100, maxWaitMs=200)
+    futures = [batcher.submit(pd.DataFrame({"a": [1]})), batcher.submit(pd.DataFrame({"b": [1]}))]
+    for future in futures:
+        future.result(timeout=5)
+    assert sorted(batchColumns) == [("a",), ("b",)]
+
+
+def test_largeInputsArePredictedDirectly():
+    callingThreads = []
+
+    def predict(x, onStage, deadline):
+        callingThreads.append(threading.current_thread())
+        return _double(x, onStage, deadline)
+
+    batcher = MicroBatcher(predict, maxRows=2, maxWaitMs=1)
+    batcher.predict(pd.DataFrame({"a": [1, 2, 3]}))
+    assert callingThreads == [threading.current_thread()]
+
+
+def test_expiredRequestsAreNotPredicted():
+    batcher = MicroBatcher(_double, maxRows=100, maxWaitMs=1)
+    future = batcher.submit(pd.DataFrame({"a": [1]}), deadline=Deadline(time.monotonic() - 1))
+    with pytest.raises(DeadlineExceeded):
+        future.result(timeout=5)
+
+
+def test_interactiveBatchIsNotDelayedByBlockedBulkBatch():
+    gate = PriorityGate(4, {PRIORITY_BULK: 1})
+    batcher = MicroBatcher(_double, maxRows=100, maxWaitMs=1,
+                           slot=lambda priority, deadline: gate.slot(PRIORITY_CLASSES[priority], deadline),
+                           maxConcurrency=4)
+    gate.acquire(PRIORITY_BULK)  # e.g. held by a streaming request
+    try:
+        bulkFuture = batcher.submit(pd.DataFrame({"a": [1]}), priority=PRIORITY_CLASSES.index(PRIORITY_BULK))
+        time.sleep(0.05)  # the bulk batch is formed and waits for its slot
+        start = time.monotonic()
+        y = batcher.predict(pd.DataFrame({"a": [2]}), deadline=Deadline.fromTimeout(2))
+        assert time.monotonic() - start < 0.5
+        assert list(y["y"]) == [4]
+        assert not bulkFuture.done()
+    finally:
+        gate.release(PRIORITY_BULK)
+    assert list(bulkFuture.result(timeout=5)["y"]) == [2]
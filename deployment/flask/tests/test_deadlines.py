@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from deadlines import Deadline, parseDeadline
+
+
+def test_timeoutIsRelativeToArrival():
+    deadline = parseDeadline("500", None, 100.0)
+    assert deadline.expiresAt == pytest.approx(100.5)
+
+
+def test_timeoutTakesPrecedenceOverUnixDeadline():
+    deadline = parseDeadline("500", str(time.time() + 60), 100.0)
+    assert deadline.expiresAt == pytest.approx(100.5)
+
+
+def test_noHeadersMeanNoDeadline():
+    assert parseDeadline(None, None, 100.0) is None
+
+
+@pytest.mark.parametrize("value", ["abc", "nan", "inf", "-inf"])
+def test_invalidValuesAreRejected(value: str):
+    with pytest.raises(ValueError):
+        parseDeadline(value, None, 100.0)
+    with pytest.raises(ValueError):
+        parseDeadline(None, value, 100.0)
+
+
+def test_latestIsUnboundedIfAnyDeadlineIs():
+    assert Deadline.latest([Deadline(1.0), None]) is None
+    assert Deadline.latest([Deadline(1.0), Deadline(2.0)]).expiresAt == 2.0
+    assert Deadline.earliest([Deadline(1.0), None]).expiresAt == 1.0
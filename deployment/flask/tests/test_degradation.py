@@ -0,0 +1,66 @@
+import time
+
+from degradation import FallbackRouter
+
+
+class _FakeRegistry:
+    def __init__(self, loaded: bool):
+        self.loaded = loaded
+        self.loadRequests = 0
+
+    def isLoaded(self) -> bool:
+        return self.loaded
+
+    def loadInBackground(self, retryIntervalSecs: float = 0):
+        self.loadRequests += 1
+
+
+def _router(queueDepth: int = 0, loaded: bool = True, **kwargs) -> FallbackRouter:
+    params = dict(fraction=1.0, maxQueueDepth=10, queueDepthFns=[lambda: queueDepth])
+    params.update(kwargs)
+    return FallbackRouter(_FakeRegistry(loaded), **params)
+
+
+def test_requestsAreRoutedToFallbackOnlyUnderOverload():
+    assert not _router(queueDepth=9).shouldUseFallback()
+    router = _router(queueDepth=10)
+    assert router.shouldUseFallback()
+    assert router.isDegraded()
+
+
+def test_fallbackIsNotUsedBeforeItIsLoaded():
+    router = _router(queueDepth=10, loaded=False)
+    assert not router.shouldUseFallback()
+    assert router.fallbackRegistry.loadRequests == 1
+
+
+def test_fractionOfRequestsIsRouted():
+    router = _router(queueDepth=10, fraction=0.0)
+    assert not any(router.shouldUseFallback() for _ in range(100))
+
+
+def test_latencySignalExpiresWithWindow():
+    router = _router(p95LatencyMs=100, latencyWindowSecs=0.05, p95RefreshSecs=0)
+    for _ in range(20):
+        router.recordPrimaryLatency(0.5)
+    assert router.isOverloaded()
+    time.sleep(0.1)
+    assert router.getP95LatencySecs() is None
+    assert not router.isOverloaded()
+
+
+def test_p95IsReusedWithinRefreshInterval():
+    router = _router(p95LatencyMs=100, p95RefreshSecs=60)
+    router.recordPrimaryLatency(0.01)
+    assert router.getP95LatencySecs() == 0.01
+    router.recordPrimaryLatency(0.5)
+    assert router.getP95LatencySecs() == 0.01
+
+
+def test_fallbackSlotsAreBounded():
+    router = _router(maxConcurrency=2)
+    assert router.tryAcquireSlot()
+    assert router.tryAcquireSlot()
+    assert not router.tryAcquireSlot()
+    router.releaseSlot()
+    assert router.tryAcquireSlot()
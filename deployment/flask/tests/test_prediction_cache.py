@@ -0,0 +1,60 @@
+import time
+
+import pandas as pd
+
+from prediction_cache import PredictionCache, computeRowHashes
+
+
+class _CountingPredictor:
+    def __init__(self):
+        self.numRows = 0
+
+    def __call__(self, x: pd.DataFrame) -> pd.DataFrame:
+        self.numRows += len(x)
+        return pd.DataFrame({"y": x["a"] * 2}, index=x.index)
+
+
+def test_rowHashesDependOnContentNotIndex():
+    hashes = computeRowHashes(pd.DataFrame({"a": [1, 2, 1]}, index=[5, 6, 7]))
+    assert hashes[0] == hashes[2] != hashes[1]
+    assert computeRowHashes(pd.DataFrame({"a": [1]}, index=[9])) == hashes[:1]
+
+
+def test_onlyMissingRowsArePredicted():
+    cache = PredictionCache(100, 60, 1 << 20)
+    predictor = _CountingPredictor()
+    cache.predict(pd.DataFrame({"a": [1, 2]}), predictor, "v1")
+    y = cache.predict(pd.DataFrame({"a": [2, 3, 1]}, index=[10, 11, 12]), predictor, "v1")
+    assert predictor.numRows == 3
+    assert list(y.index) == [10, 11, 12]
+    assert list(y["y"]) == [4, 6, 2]
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_keyIncludesModelVersionAndColumns():
+    cache = PredictionCache(100, 60, 1 << 20)
+    predictor = _CountingPredictor()
+    cache.predict(pd.DataFrame({"a": [1]}), predictor, "v1")
+    cache.predict(pd.DataFrame({"a": [1]}), predictor, "v2")
+    cache.predict(pd.DataFrame({"a": [1], "b": [0]}), predictor, "v1")
+    assert predictor.numRows == 3
+
+
+def test_entriesExpireAfterTtl():
+    cache = PredictionCache(100, 0.05, 1 << 20)
+    predictor = _CountingPredictor()
+    cache.predict(pd.DataFrame({"a": [1]}), predictor, "v1")
+    time.sleep(0.1)
+    cache.predict(pd.DataFrame({"a": [1]}), predictor, "v1")
+    assert predictor.numRows == 2
+
+
+def test_leastRecentlyUsedEntriesAreEvicted():
+    cache = PredictionCache(2, 60, 1 << 20)
+    predictor = _CountingPredictor()
+    cache.predict(pd.DataFrame({"a": [1, 2]}), predictor, "v1")
+    cache.predict(pd.DataFrame({"a": [1]}), predictor, "v1")
+    cache.predict(pd.DataFrame({"a": [3]}), predictor, "v1")
+    assert cache.evictions == 1
+    cache.predict(pd.DataFrame({"a": [1]}), predictor, "v1")
+    assert predictor.numRows == 3
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+from deadlines import Deadline, DeadlineExceeded
+from priority import PRIORITY_BULK, PRIORITY_INTERACTIVE, PriorityGate
+
+
+def test_bulkCannotExceedItsBudget():
+    gate = PriorityGate(2, {PRIORITY_BULK: 1})
+    gate.acquire(PRIORITY_BULK)
+    with pytest.raises(DeadlineExceeded):
+        gate.acquire(PRIORITY_BULK, Deadline.fromTimeout(0.05))
+    gate.acquire(PRIORITY_INTERACTIVE, Deadline.fromTimeout(0.05))
+    assert gate.inFlight == {PRIORITY_INTERACTIVE: 1, PRIORITY_BULK: 1}
+
+
+def test_totalConcurrencyIsLimited():
+    gate = PriorityGate(2, {})
+    gate.acquire(PRIORITY_INTERACTIVE)
+    gate.acquire(PRIORITY_BULK)
+    with pytest.raises(DeadlineExceeded):
+        gate.acquire(PRIORITY_INTERACTIVE, Deadline.fromTimeout(0.05))
+    assert gate.numWaiting(PRIORITY_INTERACTIVE) == 0
+
+
+def test_freedSlotIsGrantedToInteractiveWaiterFirst():
+    gate = PriorityGate(1, {})
+    gate.acquire(PRIORITY_INTERACTIVE)
+    granted = []
+
+    def wait(priorityClass: str):
+        gate.acquire(priorityClass, Deadline.fromTimeout(5))
+        granted.append(priorityClass)
+
+    threads = [threading.Thread(target=wait, args=(c,)) for c in (PRIORITY_BULK, PRIORITY_INTERACTIVE)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    gate.release(PRIORITY_INTERACTIVE)
+    threads[1].join(5)
+    assert granted == [PRIORITY_INTERACTIVE]
+    gate.release(PRIORITY_INTERACTIVE)
+    threads[0].join(5)
+    assert granted == [PRIORITY_INTERACTIVE, PRIORITY_BULK]
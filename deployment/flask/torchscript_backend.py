@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import torch
+from sensai.torch.torch_base import TorchVectorClassificationModel
+
+from inference import findSentenceEncodingGenerators
+from payload import EMBEDDINGS_COLUMN
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_ENCODER_NAME = "bert-base-nli-mean-tokens"
+
+
+class _ClassifierGraph(torch.nn.Module):
+    """
+    Input scaling, MLP and normalisation of the outputs to class probabilities, i.e. the part of
+    TorchVectorClassificationModel._predictClassProbabilities which operates on tensors
+    """
+    def __init__(self, module: torch.nn.Module, inputTranslate: torch.Tensor, inputScale: torch.Tensor,
+                 outputTranslate: torch.Tensor, outputScale: torch.Tensor):
+        super().__init__()
+        self.module = module
+        self.register_buffer("inputTranslate", inputTranslate)
+        self.register_buffer("inputScale", inputScale)
+        self.register_buffer("outputTranslate", outputTranslate)
+        self.register_buffer("outputScale", outputScale)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        y = self.module((x - self.inputTranslate) / self.inputScale)
+        y = y * self.outputScale + self.outputTranslate
+        return y / y.sum(dim=1, keepdim=True)
+
+
+def _scalerTensors(scaler, dim: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    translate = getattr(scaler, "translate", None)
+    scale = getattr(scaler, "scale", None)
+    translate = translate.float().cpu() if translate is not None else torch.zeros(dim)
+    scale = scale.float().cpu() if scale is not None else torch.ones(dim)
+    return translate.expand(dim).clone(), scale.expand(dim).clone()
+
+
+def getMetadataPath(path: str) -> str:
+    """
+    :return: the path of the metadata file belonging to the given TorchScript file
+    """
+    return os.path.splitext(path)[0] + ".json"
+
+
+def _embeddingColumns(inputColumns: List[str]) -> str:
+    """
+    :return: the name of the embedding column from which the (flattened) input columns <name>_0, ..., <name>_<d-1> stem
+    """
+    match = re.match(r"^(.*)_0$", inputColumns[0]) if inputColumns else None
+    if match is None or inputColumns != [f"{match.group(1)}_{i}" for i in range(len(inputColumns))]:
+        raise ValueError(f"Only models whose inputs are a single flattened sentence encoding can be exported, "
+                         f"got input columns {inputColumns[:3]}...")
+    return match.group(1)
+
+
+def exportTorchScript(model: TorchVectorClassificationModel, path: str, encoderName: str = DEFAULT_ENCODER_NAME):
+    """
+    Exports the input scaling and the MLP of the given classifier (which uses a single flattened sentence encoding of
+    a text column as input) as a traced TorchScript graph to path and writes the metadata required to apply it
+    (text column, encoder, input columns, labels, output column) next to it (with extension .json)
+
+    :param model: the classifier as trained in preprocessing/emr/cleaning_spark.py
+    :param path: the path of the TorchScript file (usually with extension .pt)
+    :param encoderName: the name of the sentence transformer used by the model's encoding provider
+    """
+    if len(model._inputTransformerChain.dataFrameTransformers) > 0:
+        raise ValueError("Models with input transformers cannot be exported")
+    encodingGenerators = findSentenceEncodingGenerators(model)
+    if len(encodingGenerators) != 1:
+        raise ValueError(f"Expected exactly one sentence encoding feature generator, found {len(encodingGenerators)}")
+    inputColumns = list(model._modelInputVariableNames)
+    embeddingColumn = _embeddingColumns(inputColumns)
+    dim = len(inputColumns)
+
+    torchModel = model.model
+    graph = _ClassifierGraph(torchModel.module.cpu(), *_scalerTensors(torchModel.inputScaler, dim),
+                             *_scalerTensors(torchModel.outputScaler, len(model._labels)))
+    graph.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(graph, torch.zeros(2, dim))
+    traced.save(path)
+    metadata = {
+        "textColumn": encodingGenerators[0].columnGen.columnToEncode,
+        "embeddingColumn": embeddingColumn,
+        "encoderName": encoderName,
+        "inputColumns": inputColumns,
+        "labels": [label.item() if isinstance(label, np.generic) else label for label in model._labels],
+        "outputColumns": list(model.getModelOutputVariableNames()),
+    }
+    with open(getMetadataPath(path), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    _log.info(f"Exported {model.__class__.__name__} with {dim} inputs to {path}")
+
+
+class TorchScriptReviewClassifier:
+    """
+    Lean serving backend for a classifier exported via exportTorchScript. Texts are encoded in batches by the
+    sentence transformer (shared by all instances in the process) and the traced graph computes the class
+    probabilities; no sensAI feature generation or data frame transformations are involved.
+    Inputs which already contain the embeddings (either in the flattened encoding columns, in the encoding column or
+    in EMBEDDINGS_COLUMN) are not encoded again.
+    """
+    _log = _log.getChild(__qualname__)
+    _encoders = {}
+    _encodersLock = threading.Lock()
+
+    def __init__(self, graph: torch.jit.ScriptModule, metadata: dict, encodingBatchSize: int = 32):
+        self.graph = graph
+        self.graph.eval()
+        self.textColumn: str = metadata["textColumn"]
+        self.embeddingColumn: str = metadata["embeddingColumn"]
+        self.encoderName: str = metadata["encoderName"]
+        self.inputColumns: List[str] = metadata["inputColumns"]
+        self.labels = np.array(metadata["labels"])
+        self.outputColumns: List[str] = metadata["outputColumns"]
+        self.encodingBatchSize = encodingBatchSize
+
+    @classmethod
+    def load(cls, path: str, encodingBatchSize: int = 32) -> "TorchScriptReviewClassifier":
+        with open(getMetadataPath(path), 'r') as f:
+            metadata = json.load(f)
+        return cls(torch.jit.load(path, map_location="cpu"), metadata, encodingBatchSize=encodingBatchSize)
+
+    def _getEncoder(self):
+        cls = TorchScriptReviewClassifier
+        with cls._encodersLock:
+            encoder = cls._encoders.get(self.encoderName)
+            if encoder is None:
+                from sentence_transformers import SentenceTransformer
+                self._log.info(f"Loading sentence encoder {self.encoderName}")
+                encoder = SentenceTransformer(self.encoderName)
+                cls._encoders[self.encoderName] = encoder
+            return encoder
+
+    def _findEmbeddingColumn(self, x: pd.DataFrame) -> Optional[str]:
+        for column in (EMBEDDINGS_COLUMN, self.embeddingColumn):
+            if column in x.columns:
+                return column
+        return None
+
+    def checkEmbeddings(self, x: pd.DataFrame):
+        """
+        :raises ValueError: if x contains precomputed embeddings which do not have the encoder's dimension
+        """
+        column = self._findEmbeddingColumn(x)
+        if column is None or all(c in x.columns for c in self.inputColumns):
+            return
+        dimension = len(self.inputColumns)
+        for vector in x[column].values:
+            if vector is None or np.ndim(vector) != 1 or len(vector) != dimension:
+                raise ValueError(f"Each row of {column} has to contain an embedding with {dimension} values")
+
+    def computeInputs(self, x: pd.DataFrame) -> np.ndarray:
+        """
+        :return: the float32 input matrix of the graph for the rows of x
+        :raises ValueError: if x contains precomputed embeddings which do not have the encoder's dimension
+        """
+        if all(c in x.columns for c in self.inputColumns):
+            return x[self.inputColumns].values.astype(np.float32)
+        column = self._findEmbeddingColumn(x)
+        if column is not None:
+            self.checkEmbeddings(x)
+            return np.stack(x[column].values).astype(np.float32)
+        texts = [str(text) for text in x[self.textColumn]]
+        encodings = self._getEncoder().encode(texts, batch_size=self.encodingBatchSize, show_progress_bar=False)
+        return np.asarray(encodings, dtype=np.float32)
+
+    def predictClassProbabilities(self, inputs: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return self.graph(torch.from_numpy(inputs)).numpy()
+
+    def predict(self, x: pd.DataFrame) -> pd.DataFrame:
+        probabilities = self.predictClassProbabilities(self.computeInputs(x))
+        return pd.DataFrame(self.labels[np.argmax(probabilities, axis=1)], columns=self.outputColumns, index=x.index)
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+_log = logging.getLogger(__name__)
+
+_FEATURES_FILE = "features.f32"
+_IDENTIFIERS_FILE = "identifiers.npy"
+_ROWS_FILE = "rows.npy"
+_METADATA_FILE = "metadata.json"
+
+
+class FeatureTableWriter:
+    """
+    Writes a feature table (see FeatureTable) to a directory. Feature rows are appended to disk as they arrive, so the
+    table may be far larger than memory; only the identifiers are kept in memory in order to sort them when the table
+    is closed.
+    """
+    _log = _log.getChild(__qualname__)
+
+    def __init__(self, path: str, columns: Sequence[str]):
+        """
+        :param path: the directory to write the table to
+        :param columns: the names of the feature columns
+        """
+        self.path = path
+        self.columns = list(columns)
+        os.makedirs(path, exist_ok=True)
+        self._featuresFile = open(os.path.join(path, _FEATURES_FILE), 'wb')
+        self._identifiers: List[bytes] = []
+
+    def append(self, identifiers: Sequence[str], features: np.ndarray):
+        """
+        :param identifiers: the identifiers of the rows
+        :param features: the feature matrix with one row per identifier and one column per feature column
+        """
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        if features.shape != (len(identifiers), len(self.columns)):
+            raise ValueError(f"Expected features of shape {(len(identifiers), len(self.columns))}, got {features.shape}")
+        self._featuresFile.write(features.tobytes())
+        self._identifiers.extend(str(identifier).encode("utf-8") for identifier in identifiers)
+
+    def appendDataFrame(self, df: pd.DataFrame):
+        """
+        :param df: a data frame with the identifiers as index and the feature columns
+        """
+        self.append(list(df.index), df[self.columns].values)
+
+    def close(self):
+        self._featuresFile.close()
+        identifiers = np.array(self._identifiers, dtype=bytes) if self._identifiers else np.zeros(0, dtype="S1")
+        order = np.argsort(identifiers, kind="stable")
+        sortedIdentifiers = identifiers[order]
+        if len(sortedIdentifiers) > 1 and np.any(sortedIdentifiers[1:] == sortedIdentifiers[:-1]):
+            raise ValueError("The identifiers of a feature table have to be unique")
+        np.save(os.path.join(self.path, _IDENTIFIERS_FILE), sortedIdentifiers)
+        np.save(os.path.join(self.path, _ROWS_FILE), order.astype(np.int64))
+        with open(os.path.join(self.path, _METADATA_FILE), 'w') as f:
+            json.dump({"columns": self.columns, "numRows": len(identifiers)}, f)
+        self._log.info(f"Wrote feature table with {len(identifiers)} rows and {len(self.columns)} columns to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._featuresFile.close()
+
+
+class FeatureTable:
+    """
+    Read-only table of precomputed feature vectors keyed by identifier, which is memory-mapped rather than loaded:
+    the float32 feature matrix and the sorted identifiers are mapped from disk, lookups are binary searches on the
+    identifiers and only the pages holding the requested rows are read. The table can therefore be far larger than
+    memory and is shared by all processes mapping it.
+    """
+    def __init__(self, path: str):
+        """
+        :param path: the directory written by FeatureTableWriter
+        """
+        self.path = path
+        with open(os.path.join(path, _METADATA_FILE), 'r') as f:
+            metadata = json.load(f)
+        self.columns: List[str] = metadata["columns"]
+        numRows = metadata["numRows"]
+        self._identifiers = np.load(os.path.join(path, _IDENTIFIERS_FILE), mmap_mode='r')
+        self._rows = np.load(os.path.join(path, _ROWS_FILE), mmap_mode='r')
+        self._features = np.memmap(os.path.join(path, _FEATURES_FILE), dtype=np.float32, mode='r',
+                                   shape=(numRows, len(self.columns))) if numRows > 0 \
+            else np.zeros((0, len(self.columns)), dtype=np.float32)
+
+    def __len__(self):
+        return len(self._identifiers)
+
+    def checkColumns(self, columns: Sequence[str]):
+        """
+        :param columns: the columns the rows are used for, in order (e.g. the input columns of a model)
+        :raises ValueError: if the table's columns differ from the given ones
+        """
+        columns = list(columns)
+        if columns == self.columns:
+            return
+        if len(columns) != len(self.columns):
+            raise ValueError(f"The table has {len(self.columns)} columns, expected {len(columns)}")
+        position = next(i for i, (a, b) in enumerate(zip(self.columns, columns)) if a != b)
+        raise ValueError(f"Column {position} of the table is {self.columns[position]}, expected {columns[position]}")
+
+    def lookup(self, identifiers: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param identifiers: the identifiers to look up
+        :return: a pair (found, features) where found is a boolean array indicating which identifiers are in the
+            table and features contains the feature rows of the found identifiers (in the given order)
+        """
+        keys = np.array([str(identifier).encode("utf-8") for identifier in identifiers], dtype=bytes)
+        if len(self._identifiers) == 0:
+            return np.zeros(len(keys), dtype=bool), np.zeros((0, len(self.columns)), dtype=np.float32)
+        positions = np.searchsorted(self._identifiers, keys)
+        positions = np.minimum(positions, len(self._identifiers) - 1)
+        found = self._identifiers[positions] == keys
+        rows = self._rows[positions[found]]
+        return found, np.asarray(self._features[rows])
+
+    def lookupDataFrame(self, identifiers: Iterable[str]) -> Tuple[pd.DataFrame, List[str]]:
+        """
+        :param identifiers: the identifiers to look up
+        :return: a pair (df, missing) where df contains the features of the found identifiers (with the identifiers
+            as index) and missing is the list of identifiers which are not in the table
+        """
+        identifiers = list(identifiers)
+        found, features = self.lookup(identifiers)
+        foundIdentifiers = [identifier for identifier, isFound in zip(identifiers, found) if isFound]
+        missing = [identifier for identifier, isFound in zip(identifiers, found) if not isFound]
+        return pd.DataFrame(features, columns=self.columns, index=foundIdentifiers), missing
@@ -1,4 +1,5 @@
 import logging
+import threading
 from abc import ABC, abstractmethod
 from typing import Union, List, Generic, TypeVar
 
@@ -50,8 +51,20 @@ class BertBaseMeanSentenceEncoder(SentenceEncoder):
 
 
 class BertBaseMeanEncodingProvider(TransientInstanceProvider[BertBaseMeanSentenceEncoder]):
+    """
+    Provides the BERT encoder, which is shared by all providers in the process, such that serving several models
+    which use it does not load the BERT weights more than once
+    """
+    _sharedInstance = None
+    _sharedInstanceLock = threading.Lock()
+
     def _getInstance(self):
-        return BertBaseMeanSentenceEncoder()
+        cls = BertBaseMeanEncodingProvider
+        with cls._sharedInstanceLock:
+            if cls._sharedInstance is None:
+                self._log.info("Loading BERT sentence encoder")
+                cls._sharedInstance = BertBaseMeanSentenceEncoder()
+            return cls._sharedInstance
 
 
 class ColumnGeneratorSentenceEncodings(sn.columngen.ColumnGeneratorCachedByIndex):
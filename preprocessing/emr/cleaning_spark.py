@@ -11,7 +11,9 @@ from sensai.data_transformation import DFTNormalisation
 from sensai.evaluation import evalModelViaEvaluator
 from sensai.featuregen import FeatureGeneratorFromColumnGenerator, FeatureCollector, flattenedFeatureGenerator
 from sensai.torch import models
+from sensai.vector_model import VectorModel
 
+from models.feature_table import FeatureTableWriter
 from models.utils import ColumnGeneratorSentenceEncodings, BertBaseMeanEncodingProvider
 
 _log = logging.getLogger(__name__)
@@ -93,6 +95,21 @@ def manipulateNestedThroughRdd(df, parentColName, childColName, mapping,
     return _spark.createDataFrame(df.rdd.map(adjustRow), newSchemaString)
 
 
+def buildFeatureTable(model: VectorModel, df: pd.DataFrame, path: str, chunkRows: int = 10000):
+    """
+    Computes the model's input features for all rows of df and writes them to a memory-mappable feature table keyed by
+    the index of df (the review identifier), which is served by the service's identifier-based endpoint
+
+    :param model: the fitted model whose feature generation is applied
+    :param df: the input data frame with the identifiers as index
+    :param path: the directory to write the table to
+    :param chunkRows: the number of rows whose features are computed at once
+    """
+    with FeatureTableWriter(path, model._modelInputVariableNames) as writer:
+        for start in range(0, len(df), chunkRows):
+            writer.appendDataFrame(model._computeInputs(df.iloc[start:start + chunkRows]))
+
+
 if __name__ == "__main__":
     sc = SparkContext.getOrCreate()
     spark = SparkSession(sc).builder.master("local").getOrCreate()
@@ -150,3 +167,5 @@ if __name__ == "__main__":
         loadedModel = pickle.load(f)
 
     loadedModel.predict(flattenedPandasDf)
+
+    buildFeatureTable(reviewClassifier, flattenedPandasDf, "reviewFeatureTable")